@@ -0,0 +1,10 @@
+"""
+Benchmarks of YAX on generated documents. Run them with
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json
+
+(see python -m benchmarks --help).
+"""
+from .generators import GENERATORS
+from .run import run, compare, measure, main
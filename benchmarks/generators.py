@@ -0,0 +1,111 @@
+import random
+
+__author__ = 'Móréh, Tamás'
+
+# The documents depend only on the size and the seed.
+SEED = 1984
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+         "exercitation ullamco laboris nisi aliquip ex ea commodo consequat").split()
+
+
+class Document:
+    """
+    Collects the parts of a generated document and counts its size and elements.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<{}>\n'.format(root)]
+        self.size = len(self.parts[0])
+        self.elements = 1
+
+    def add(self, s: str, elements: int):
+        self.parts.append(s)
+        self.size += len(s)
+        self.elements += elements
+
+    def result(self) -> tuple:
+        """
+        :return: (document as bytes, number of elements)
+        """
+        self.parts.append("</{}>\n".format(self.root))
+        return "".join(self.parts).encode("utf-8"), self.elements
+
+
+def sentence(rnd: random.Random, words: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(words))
+
+
+def records(size: int, seed: int=SEED) -> tuple:
+    """
+    Flat list of small records, like a database export.
+    """
+    rnd = random.Random(seed)
+    doc = Document("catalog")
+    i = 0
+    while doc.size < size:
+        tags = rnd.randint(0, 4)
+        doc.add('  <record id="{}" type="{}">\n    <name>{}</name>\n    <price>{:.2f}</price>\n'
+                '    <tags>{}</tags>\n  </record>\n'.format(
+                    i, rnd.choice("abc"), sentence(rnd, 3), rnd.uniform(1, 1000),
+                    "".join("<tag>{}</tag>".format(rnd.choice(WORDS)) for _ in range(tags))),
+                4 + tags)
+        i += 1
+    return doc.result()
+
+
+def nested(size: int, seed: int=SEED, depth: int=40) -> tuple:
+    """
+    Deep chains of nodes, the records are the outermost ones.
+    """
+    rnd = random.Random(seed)
+    doc = Document("tree")
+    i = 0
+    while doc.size < size:
+        levels = rnd.randint(depth // 2, depth)
+        opening = "".join('<node level="{}">'.format(k) for k in range(1, levels))
+        doc.add('<record id="{}">{}<name>{}</name>{}</record>\n'.format(
+            i, opening, rnd.choice(WORDS), "</node>" * (levels - 1)), levels + 1)
+        i += 1
+    return doc.result()
+
+
+def attributes(size: int, seed: int=SEED, count: int=16) -> tuple:
+    """
+    Empty elements with many attributes.
+    """
+    rnd = random.Random(seed)
+    doc = Document("items")
+    i = 0
+    while doc.size < size:
+        attrib = "".join(' a{}="{}"'.format(k, rnd.choice(WORDS)) for k in range(count))
+        doc.add('  <record id="{}"{}><name a="{}" b="{}"/></record>\n'.format(
+            i, attrib, rnd.randint(0, 99), rnd.choice(WORDS)), 2)
+        i += 1
+    return doc.result()
+
+
+def text(size: int, seed: int=SEED) -> tuple:
+    """
+    Long paragraphs with some inline markup, like an article corpus.
+    """
+    rnd = random.Random(seed)
+    doc = Document("corpus")
+    i = 0
+    while doc.size < size:
+        inline = rnd.randint(0, 3)
+        body = "".join("{} <b>{}</b> ".format(sentence(rnd, rnd.randint(20, 80)), rnd.choice(WORDS))
+                       for _ in range(inline))
+        doc.add('  <record id="{}">\n    <name>{}</name>\n    <p>{}{}</p>\n  </record>\n'.format(
+            i, sentence(rnd, 4), body, sentence(rnd, rnd.randint(50, 200))), 3 + inline)
+        i += 1
+    return doc.result()
+
+
+# Every document has <record id="..."> elements with a <name> child.
+GENERATORS = {"records": records,
+              "nested": nested,
+              "attributes": attributes,
+              "text": text}
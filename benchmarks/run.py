@@ -0,0 +1,247 @@
+import io
+import re
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import multiprocessing
+from yax import YAXReader, CallbackRunner
+from .generators import GENERATORS, WORDS
+
+try:
+    import resource
+except ImportError:             # Not on Windows
+    resource = None
+
+__author__ = 'Móréh, Tamás'
+
+CONVERTERS = {"etree": CallbackRunner.ETREE,
+              "string": CallbackRunner.STRING,
+              "dict": CallbackRunner.DICT,
+              "json_dict": CallbackRunner.JSON_DICT}
+
+# The cases are identified by these fields in the results and in the baseline.
+KEY = ("shape", "backend", "conditions", "converter", "positions")
+
+
+def case_key(result: dict) -> tuple:
+    # The results of the earlier versions have no positions field
+    return tuple(result.get(k, False) for k in KEY)
+
+
+def conditions(count: int) -> list:
+    """
+    :return: count find() argument dicts for the generated documents. The first one matches the
+    records, the others are a mix of literal tag + attribute, regexp tag, text and parent
+    conditions which match only a few elements, so the cost of the checks is measured.
+    """
+    result = [{"tag": "record"}]
+    for k in range(1, count):
+        kind = k % 4
+        if kind == 0:
+            result.append({"tag": "record", "attrib": {"id": str(k * 7)}})
+        elif kind == 1:
+            result.append({"tag": re.compile("name{}|x".format(k))})     # Checked, not matching
+        elif kind == 2:
+            result.append({"tag": "name", "text": WORDS[k % len(WORDS)]})
+        else:
+            result.append({"tag": "name",
+                           "parent": ("record", {"id": re.compile(r"\d*{}".format(k % 10))})})
+    return result
+
+
+def run_case(data: bytes, backend: str, count: int, converter: str, chunk_size=None,
+             positions=False) -> tuple:
+    """
+    Parses the document once.
+    :return: (seconds, number of the callback calls)
+    """
+    yr = YAXReader(io.BytesIO(data), use_lxml=backend == "lxml", positions=positions)
+    calls = [0]
+
+    def callback(e, l):
+        calls[0] += 1
+
+    for kwargs in conditions(count):
+        yr.find(**kwargs).converts(CONVERTERS[converter]).calls(callback)
+    start = time.perf_counter()
+    yr.start(chunk_size)
+    return time.perf_counter() - start, calls[0]
+
+
+def peak_rss() -> int:
+    """
+    :return: the peak resident set size of the process in KiB or None if it is unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _measure(args, conn):
+    try:
+        conn.send(measure(*args))
+    except Exception as e:
+        conn.send(e)
+    conn.close()
+
+
+def measure(data: bytes, elements: int, backend: str, count: int, converter: str,
+            repeat: int=3, chunk_size=None, positions=False) -> dict:
+    """
+    Runs a case repeat times and takes the best time. The peak RSS is the peak of the process,
+    so measure_isolated() runs it in a new process.
+    """
+    rss_before = peak_rss()
+    seconds, calls = min(run_case(data, backend, count, converter, chunk_size, positions)
+                         for _ in range(repeat))
+    rss = peak_rss()
+    return {"bytes": len(data), "elements": elements, "calls": calls,
+            "seconds": round(seconds, 6),
+            "mb_per_s": round(len(data) / seconds / 1e6, 3),
+            "elements_per_s": round(elements / seconds, 1),
+            "peak_rss_kb": rss,
+            "rss_growth_kb": None if rss is None else rss - rss_before}
+
+
+def measure_isolated(*args) -> dict:
+    """
+    measure() in a forked process (the document is shared with it), so the peak RSS of the
+    cases are independent. Without fork it runs in this process.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return measure(*args)
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_measure, args=(args, child))
+    process.start()
+    child.close()
+    result = parent.recv()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def backends(requested: list) -> list:
+    available = []
+    for backend in requested:
+        if backend == "lxml":
+            try:
+                import lxml.etree
+            except ImportError:
+                print("lxml is not installed, skipped.", file=sys.stderr)
+                continue
+        available.append(backend)
+    return available
+
+
+def run(size: int, shapes: list, backend_names: list, counts: list, converters: list,
+        repeat: int=3, chunk_size=None, progress=None, positions=False) -> dict:
+    """
+    Runs all the combinations of the arguments.
+    :param size: approximate size of the generated documents in bytes
+    :param positions: every case runs also with positions=True (the cost of the positions)
+    :param progress: called with each result
+    :return: dict of the environment ("meta") and the list of the results ("results")
+    """
+    results = []
+    for shape in shapes:
+        data, elements = GENERATORS[shape](size)
+        for backend in backends(backend_names):
+            for count in counts:
+                for converter, tracked in itertools.product(converters, (False, True)
+                                                            if positions else (False, )):
+                    result = {"shape": shape, "backend": backend, "conditions": count,
+                              "converter": converter, "positions": tracked}
+                    result.update(measure_isolated(data, elements, backend, count, converter,
+                                                   repeat, chunk_size, tracked))
+                    results.append(result)
+                    if progress is not None:
+                        progress(result)
+    meta = {"python": platform.python_version(), "implementation":
+            platform.python_implementation(), "platform": platform.platform(),
+            "size": size, "repeat": repeat, "chunk_size": chunk_size}
+    try:
+        import lxml.etree
+        meta["lxml"] = ".".join(map(str, lxml.etree.LXML_VERSION))
+    except ImportError:
+        meta["lxml"] = None
+    return {"meta": meta, "results": results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float=0.1) -> list:
+    """
+    Compares the throughput and the RSS growth of the cases with the baseline.
+    :param tolerance: allowed relative change
+    :return: list of (case key, field, baseline value, current value) of the regressions
+    """
+    old = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        key = case_key(r)
+        b = old.get(key)
+        if b is None:
+            continue
+        if r["mb_per_s"] < b["mb_per_s"] * (1 - tolerance):
+            regressions.append((key, "mb_per_s", b["mb_per_s"], r["mb_per_s"]))
+        if r.get("rss_growth_kb") is not None and b.get("rss_growth_kb") is not None and \
+                r["rss_growth_kb"] > b["rss_growth_kb"] * (1 + tolerance) + 1024:
+            regressions.append((key, "rss_growth_kb", b["rss_growth_kb"], r["rss_growth_kb"]))
+    return regressions
+
+
+def report(result: dict, baseline: dict=None, file=sys.stderr):
+    old = {} if baseline is None else {case_key(r): r for r in baseline["results"]}
+    b = old.get(case_key(result))
+    change = "" if b is None else " ({:+.1%})".format(result["mb_per_s"] / b["mb_per_s"] - 1)
+    print("{shape:>10} {backend:>4} {conditions:>4} {converter:>9}{0:>4}: {mb_per_s:8.2f} MB/s "
+          "{elements_per_s:12.0f} el/s {peak_rss_kb} KiB".format(
+              " pos" if result.get("positions") else "", **result) + change, file=file)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Throughput and memory benchmarks of YAX.")
+    parser.add_argument("--size", type=float, default=4,
+                        help="size of the generated documents in MB (default: 4)")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(GENERATORS),
+                        default=["records", "nested", "attributes", "text"])
+    parser.add_argument("--backends", nargs="+", choices=["xml", "lxml"], default=["xml", "lxml"])
+    parser.add_argument("--conditions", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--converters", nargs="+", choices=sorted(CONVERTERS),
+                        default=["etree", "string", "dict", "json_dict"])
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the best counts")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--positions", action="store_true",
+                        help="run every case also with positions=True")
+    parser.add_argument("--output", help="write the results as JSON to this file (default: "
+                                         "stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative slowdown or memory growth (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = run(int(args.size * 1e6), args.shapes, args.backends, args.conditions,
+                  args.converters, args.repeat, args.chunk_size,
+                  progress=lambda r: report(r, baseline), positions=args.positions)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for key, field, old, new in regressions:
+            print("Regression: {} {}: {} -> {}".format(" ".join(map(str, key)), field, old, new),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,39 @@
+__author__ = 'Tamás'
+
+import unittest
+import xml.etree.ElementTree as ElementTree
+from benchmarks.generators import GENERATORS
+from benchmarks.run import conditions, measure, compare
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def test_generators(self):
+        for name, generate in GENERATORS.items():
+            data, elements = generate(20000)
+            self.assertEqual(generate(20000), (data, elements), name)
+            self.assertGreaterEqual(len(data), 20000)
+            root = ElementTree.fromstring(data)
+            self.assertEqual(sum(1 for _ in root.iter()), elements, name)
+            self.assertTrue(root.findall("record/[@id]"), name)
+
+    def test_measure(self):
+        data, elements = GENERATORS["records"](20000)
+        self.assertEqual(len(conditions(10)), 10)
+        result = measure(data, elements, "xml", 10, "json_dict", repeat=1)
+        self.assertEqual(result["elements"], elements)
+        self.assertGreaterEqual(result["calls"], len(ElementTree.fromstring(data)))
+        self.assertGreater(result["mb_per_s"], 0)
+        positions = measure(data, elements, "xml", 10, "json_dict", repeat=1, positions=True)
+        self.assertEqual(positions["calls"], result["calls"])
+
+        case = {"shape": "records", "backend": "xml", "conditions": 10, "converter": "json_dict"}
+        baseline = {"results": [dict(case, mb_per_s=10.0, rss_growth_kb=1000)]}
+        self.assertEqual(compare({"results": [dict(case, mb_per_s=9.5, rss_growth_kb=1500)]},
+                                 baseline), [])
+        self.assertEqual(len(compare({"results": [dict(case, mb_per_s=5.0, rss_growth_kb=9000)]},
+                                     baseline)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
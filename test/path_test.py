@@ -0,0 +1,129 @@
+__author__ = 'Tamás'
+
+import unittest
+import io
+from yax.YAXReader import YAXReader, Condition, CallbackRunner
+from yax.condition import ConditionException
+from yax.path import Path, PathTracker
+
+FEED = """<?xml version="1.0"?>
+<feed xmlns:m="urn:media" xml:lang="hu">
+    <title>Feed</title>
+    <entry type="x" id="1"><link href="1"/><content><link href="deep"/></content></entry>
+    <entry type="y" id="2"><link href="2">alt</link></entry>
+    <group><entry type="x" id="3"><link href="3"/><m:thumb url="t3"/></entry></group>
+    <entry type="x" id="4"><title>Four</title><link href="4" rel="alt">alt</link></entry>
+</feed>
+"""
+
+
+class PathTest(unittest.TestCase):
+
+    use_lxml = False
+
+    def select(self, *paths, text=FEED):
+        found = []
+        yr = YAXReader(io.StringIO(text), use_lxml=self.use_lxml)
+        for i, path in enumerate(paths):
+            if isinstance(path, str):
+                path = Path(path, {"m": "urn:media"})
+            yr.match(path).calls(lambda e, l, i=i: found.append(
+                (i, e.get("href") or e.get("id") or e.get("url") or e.tag)))
+        yr.start()
+        return found
+
+    def hrefs(self, path):
+        return [v for _, v in self.select(path)]
+
+    def test_child_axis(self):
+        self.assertEqual(self.hrefs("/feed/entry[@type='x']/link"), ["1", "4"])
+        self.assertEqual(self.hrefs("/feed/entry/link"), ["1", "2", "4"])
+        self.assertEqual(self.hrefs("/feed/*/link[@href!='1']"), ["2", "4"])
+        self.assertEqual(self.hrefs("/*"), ["feed"])
+        self.assertEqual(self.hrefs("/entry"), [])
+        self.assertEqual(self.hrefs("/feed/entry[@type='x'][@id='4']"), ["4"])
+        self.assertEqual(self.hrefs("/feed/entry[@type='x' and @id!=\"4\"]"), ["1"])
+
+    def test_descendant_axis(self):
+        self.assertEqual(self.hrefs("//entry/link"), ["1", "2", "3", "4"])
+        self.assertEqual(self.hrefs("entry//link"), ["1", "deep", "2", "3", "4"])
+        self.assertEqual(self.hrefs("/feed//entry[@type='x']//link"), ["1", "deep", "3", "4"])
+        self.assertEqual(self.hrefs("//group//link"), ["3"])
+        self.assertEqual(self.hrefs("//link[@rel]"), ["4"])
+        self.assertEqual(self.hrefs("//link[@rel!='x']"), ["4"])          # Not the ones without rel
+        self.assertEqual(self.hrefs("//entry[@type!='x']/link"), ["2"])
+        self.assertEqual(self.hrefs("//feed//title"), ["title", "title"])
+
+    def test_predicates(self):
+        self.assertEqual(self.hrefs("//link[text()='alt']"), ["2", "4"])
+        self.assertEqual(self.hrefs("//entry[@type='x']/link[text()]"), ["4"])
+        self.assertEqual(self.hrefs("/feed/title[text()!='Feed']"), [])
+        self.assertEqual(self.hrefs("//m:thumb"), ["t3"])
+        self.assertEqual(self.hrefs("//{urn:media}thumb[@url='t3']"), ["t3"])
+        self.assertEqual(self.hrefs("/feed[@xml:lang='hu']/group/entry"), ["3"])
+        for path in ("/feed/entry[text()='x']/link", "//entry[1]", "/feed/@type", "/feed/",
+                     "//entry[@type='x'", "//x:entry", "/feed/../entry", ""):
+            with self.assertRaises(ConditionException, msg=path):
+                Path(path)
+
+    def test_same_as_conditions(self):
+        paths = ["/feed/entry[@type='x']/link", "//link", "//entry/*", "/feed/entry"]
+        conditions = [Condition("link", parent=("entry", {"type": "x"}, None, "feed")),
+                      Condition("link"), Condition(None, parent="entry"),
+                      Condition("entry", parent="feed")]
+        found = self.select(*paths)
+        expected = []
+        yr = YAXReader(io.StringIO(FEED), use_lxml=self.use_lxml)
+        for i, cond in enumerate(conditions):
+            yr.match(cond).calls(lambda e, l, i=i: expected.append(
+                (i, e.get("href") or e.get("id") or e.get("url") or e.tag)))
+        yr.start()
+        self.assertEqual(found, expected)
+
+    def test_keep_children(self):
+        found = []
+        yr = YAXReader(io.StringIO(FEED), use_lxml=self.use_lxml)
+        yr.match(Path("//entry[@type='x']", keep_children="link"))\
+            .converts(CallbackRunner.JSON_DICT).calls(lambda e, l: found.append(e))
+        yr.start()
+        self.assertEqual(found, [{"entry": {"-type": "x", "-id": "1", "link": {"-href": "1"}}},
+                                 {"entry": {"-type": "x", "-id": "3", "link": {"-href": "3"}}},
+                                 {"entry": {"-type": "x", "-id": "4",
+                                            "link": {"-href": "4", "-rel": "alt", "#text": "alt"}}}])
+
+    def test_inverted(self):
+        found = self.select(Path("//entry/*").inverse(), text="<a><entry><b/></entry><c/></a>")
+        self.assertEqual([v for _, v in found], ["entry", "c", "a"])
+
+    def test_tracker(self):
+        # Each ancestor is stepped once, however deep the document and however many paths
+        depth = 150
+        text = "<r>" + "<n>" * depth + "<leaf/>" * 20 + "</n>" * depth + "</r>"
+        steps = []
+        original = PathTracker.step
+
+        def counting(tracker, states, element):
+            steps.append(element.tag)
+            return original(tracker, states, element)
+
+        paths = ["//n/leaf", "/r/n/n", "//leaf[@x]", "n//n//leaf", "/r//leaf"]
+        PathTracker.step = counting
+        try:
+            found = self.select(*paths, text=text)
+        finally:
+            PathTracker.step = original
+        self.assertEqual(len(steps), 1 + depth + 20)
+        self.assertEqual(sorted(i for i, _ in found), [0] * 20 + [1] + [3] * 20 + [4] * 20)
+
+        path = Path("//b")
+        self.assertEqual(PathTracker.of([(path, None), (Condition("a"), None)]).paths, {path})
+        self.assertIsNone(PathTracker.of([(Condition("a"), None)]))
+
+
+class PathLxmlTest(PathTest):
+
+    use_lxml = True
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,897 @@
+__author__ = 'Tamás'
+
+import unittest
+import io
+import time
+import threading
+import asyncio
+import os
+import tempfile
+import itertools
+import sys
+import re
+import json
+from yax.YAXReader import YAXReader, DispatchTable, CallbackRunner, Condition
+from yax.condition import EmptyCondition, EvalContext
+from yax.position import Position, Checkpoint
+
+yax_reader = sys.modules[YAXReader.__module__]
+
+CATALOG = """<?xml version="1.0"?>
+<CATALOG name="first">
+    <PLANT id="1">
+        <COMMON>Hepatica</COMMON>
+        <PRICE>$4.45</PRICE>
+    </PLANT>
+    <PLANT id="2">
+        <COMMON>Columbine</COMMON>
+        <PRICE>$9.37</PRICE>
+    </PLANT>
+    <plant id="3">
+        <COMMON>Marsh Marigold</COMMON>
+        <PRICE>$6.81</PRICE>
+    </plant>
+    <TREE id="4">
+        <COMMON>Oak</COMMON>
+        <PRICE>$99.00</PRICE>
+    </TREE>
+</CATALOG>
+"""
+
+
+class YAXReaderTest(unittest.TestCase):
+
+    use_lxml = False
+
+    def reader(self, text=CATALOG):
+        return YAXReader(io.StringIO(text), use_lxml=self.use_lxml)
+
+    def register(self, yr, calls):
+        def cb(name):
+            return lambda e, l: calls.append((name, e.tag, e.get("id")))
+        yr.find("PLANT").calls(cb("literal"))
+        yr.find(["PLANT", "plant"], children={"tag": "PRICE", "text": re.compile(r"\$[0-9]\.\d+")})\
+            .calls(cb("list"))
+        yr.find(re.compile("plant", re.I)).calls(cb("regex"))
+        yr.find(lambda t: t.startswith("T")).calls(cb("callable"))
+        yr.find("COMMON", parent=("PLANT", {"id": "2"})).calls(cb("parent"))
+        yr.find("PRICE", text=re.compile(r"\$9.*")).calls(cb("text"))
+        yr.find(attrib={"id": "4"}).calls(cb("any"))
+        yr.find("PLANT").inverted().calls(cb("inverted"))
+
+    def test_dispatch_table(self):
+        yr = self.reader()
+        yr.find("a")
+        yr.find(["a", "b"])
+        yr.find(re.compile("c"))
+        yr.find("b").inverted()
+        table = DispatchTable(yr._cnds, yr.lxml)
+        runners = [r for _, r in yr._cnds]
+        self.assertEqual([r for _, r in table.handlers("a")], runners[0:4])
+        self.assertEqual([r for _, r in table.handlers("b")], runners[1:4])
+        self.assertEqual([r for _, r in table.handlers("x")], runners[2:4])
+        self.assertEqual([c for c, _ in table.handlers("x")], table.checks[2:4])
+        self.assertEqual(table.keepers("b"), table.keeps[1:4])
+        self.assertEqual(table.keepers("x"), table.keeps[2:3])
+
+    def test_dispatch_same_as_linear(self):
+        calls = []
+        yr = self.reader()
+        self.register(yr, calls)
+        yr.start()
+
+        expected = []
+        yr2 = self.reader()
+        self.register(yr2, expected)
+        table = DispatchTable(yr2._cnds, yr2.lxml)
+        checks = [(c.checker(yr2.lxml), r) for c, r in yr2._cnds]
+        table.handlers = lambda tag: checks         # The linear scan
+        table.keepers = lambda tag: [c.keeper(yr2.lxml) for c, _ in yr2._cnds]
+        orig = yax_reader.DispatchTable
+        yax_reader.DispatchTable = lambda cnds, lxml: table
+        try:
+            yr2.start()
+        finally:
+            yax_reader.DispatchTable = orig
+        self.assertEqual(calls, expected)
+        self.assertIn(("list", "plant", "3"), calls)
+        self.assertIn(("parent", "COMMON", None), calls)
+        self.assertIn(("callable", "TREE", "4"), calls)
+        self.assertIn(("inverted", "CATALOG", None), calls)
+
+    def test_iterfind(self):
+        calls = []
+        yr = self.reader()
+        yr.find("TREE").calls(lambda e, l: calls.append(e.tag))
+        yr.find("plant")                                # Without callback, not yielded
+        found = [(e, l) for e, l in yr.iterfind("PLANT", keep_children="COMMON",
+                                                    t=CallbackRunner.JSON_DICT)]
+        self.assertEqual([e["PLANT"]["COMMON"] for e, l in found], ["Hepatica", "Columbine"])
+        self.assertEqual(calls, ["TREE"])
+        self.assertTrue(yr.stream.closed)
+
+    def test_iter(self):
+        yr = self.reader()
+        yr.find(["PLANT", "plant"], children="PRICE")
+        yr.find("PRICE").calls(lambda e, l: None)
+        self.assertEqual([e.get("id") for e, l in yr], ["1", "2", "3"])
+
+    def test_iter_break(self):
+        stream = io.StringIO(CATALOG)
+        yr = YAXReader(stream, use_lxml=self.use_lxml)
+        yr.find("COMMON")
+        first = list(itertools.islice((e.text for e, l in yr), 2))
+        self.assertEqual(first, ["Hepatica", "Columbine"])
+        self.assertTrue(stream.closed)
+
+    def test_parent_chain(self):
+        depth = 30
+        text = "".join("<n{} i='{}'>".format(i % 3, i) for i in range(depth)) + "<leaf/>" + \
+               "".join("</n{}>".format(i % 3) for i in reversed(range(depth)))
+        calls = []
+        yr = self.reader(text)
+        chain = None
+        for i in range(depth - 5, depth):               # The 5 nearest ancestors
+            chain = Condition("n{}".format(i % 3), {"i": str(i)}, parent=chain)
+        yr.find("leaf", parent=chain).calls(lambda e, l: calls.append(e.tag))
+        yr.find("leaf", parent=Condition("n0", parent=Condition("n0"))).calls(
+            lambda e, l: calls.append("wrong"))
+        yr.find("n2", {"i": "2"}, parent=("n1", None, None, ("n0", {"i": "0"}))).calls(
+            lambda e, l: calls.append(e.tag))
+        yr.find("n0", parent=Condition(parent=Condition(parent=Condition(parent="x")))).calls(
+            lambda e, l: calls.append("wrong"))
+        yr.start()
+        self.assertEqual(calls, ["leaf", "n2"])
+
+    def test_eval_context(self):
+        checked = []
+
+        def cheap(text):
+            checked.append(text)
+            return float(text[1:]) < 10
+
+        yr = self.reader()
+        price = Condition("PRICE", text=cheap)
+        calls = []
+        yr.find("PLANT", children=price).calls(lambda e, l: calls.append(e.get("id")))
+        yr.find("PLANT", {"id": "2"}, children=price).calls(lambda e, l: calls.append("2"))
+        yr.start()
+        self.assertEqual(calls, ["1", "2", "2"])
+        # Once at the PRICE end event (keep) and once at the PLANT end event (children)
+        self.assertEqual(checked, ["$4.45", "$4.45", "$9.37", "$9.37"])
+
+        # The compiled conditions read the texts and the attributes through the context
+        read = []
+        original = (EvalContext.text, EvalContext.attrib)
+
+        def text(ctx, element):
+            read.append(element.tag)
+            return original[0](ctx, element)
+
+        EvalContext.text = text
+        EvalContext.attrib = lambda ctx, element: read.append("@") or original[1](ctx, element)
+        try:
+            yr = self.reader()
+            yr.find("PRICE", text=re.compile(r"\$9.*")).calls(lambda e, l: calls.append(e.text))
+            yr.find(["TREE", "PRICE"], {"id": "4"}, text=True).calls(lambda e, l: None)
+            yr.start()
+        finally:
+            EvalContext.text, EvalContext.attrib = original
+        self.assertEqual(calls[-2:], ["$9.37", "$99.00"])
+        self.assertEqual(read.count("PRICE"), 4)
+        self.assertIn("@", read)
+
+    def test_compiled_conditions(self):
+        yr = self.reader()
+        root = yr.etree.fromstring(CATALOG.encode())
+
+        def conditions():
+            price = Condition("PRICE", text=re.compile(r"\$[0-9]\.\d+"))
+            return [Condition("PLANT"), Condition(["PLANT", "plant"], children=price),
+                    Condition(re.compile("plant", re.I), {"id": ["1", "3"]}),
+                    Condition(lambda t: t.startswith("T"), {"id": True}),
+                    Condition("COMMON", parent=("PLANT", {"id": "2"})),
+                    Condition("COMMON", text="Oak", parent=Condition("TREE").inverse()),
+                    Condition(attrib={"id": lambda v: int(v) > 2, "name": None}),
+                    Condition(text=True, parent=Condition(parent="CATALOG")),
+                    Condition(text=lambda t: 1 / 0),                   # Errors are False
+                    Condition(parent=Condition("PLANT").inverse()),
+                    Condition(parent=Condition(parent=Condition(parent="CATALOG"))),
+                    Condition(["PLANT", "TREE"], children=["COMMON", price],
+                              keep_children=Condition("PRICE", text=True)),
+                    Condition("PLANT").inverse(), Condition(), Condition(attrib={"k": None}),
+                    Condition(parent=EmptyCondition(True))]
+
+        def walk(element, parents):
+            yield element, parents
+            for child in element:
+                yield from walk(child, parents + [element])
+
+        lxml = yr.lxml
+        for plain, compiled in zip(conditions(), conditions()):
+            compiled.compile(lxml)
+            self.assertNotEqual(compiled.checker(lxml), plain.checker(lxml))
+            for element, parents in walk(root, []):
+                if self.use_lxml:
+                    self.assertEqual(compiled.check(element), plain.check(element))
+                    self.assertEqual(compiled.keep(element), plain.keep(element))
+                else:
+                    self.assertEqual(compiled.check(element, parents), plain.check(element, parents))
+                    self.assertEqual(compiled.keep(element, parents), plain.keep(element, parents))
+        self.assertNotEqual(conditions()[-4].compile(lxml).checker(lxml).__name__, "check")
+        self.assertEqual(conditions()[1].compile(lxml).checker(lxml).__name__, "check")
+
+    def test_no_filters(self):
+        tags = []
+        yr = self.reader("<a><b/><c><b x='1'/></c></a>")
+        yr.find().calls(lambda e, l: tags.append(e.tag))
+        yr.start()
+        self.assertEqual(tags, ["b", "b", "c", "a"])
+        yr = self.reader("<a><b/><c><b x='1'/></c></a>")
+        self.assertEqual([e.tag for e, _ in yr.iterfind(attrib={"x": None})], ["b", "b", "c", "a"])
+        for default, expected in ((True, ["b", "b", "c", "a"]), (False, [])):
+            tags = []
+            yr = self.reader("<a><b/><c><b x='1'/></c></a>")
+            yr.match(EmptyCondition(default)).calls(lambda e, l: tags.append(e.tag))
+            yr.start()
+            self.assertEqual(tags, expected)
+        with self.assertRaises(Exception):
+            self.reader().match(object())
+
+    def test_writes(self):
+        text = CATALOG.replace('<PLANT id="1">', '<PLANT id="1" note="a &amp; &lt;b&gt;">') \
+            .replace("Hepatica", "Hepatica<![CDATA[ & co]]>")
+        expected = []
+        yr = self.reader(text)
+        yr.find(["PLANT", "TREE"]).calls(lambda e, l: expected.append(
+            (yax_reader.element_to_json_dict(e), yax_reader.element_to_string(e).strip())))
+        yr.start()
+
+        jsonl = io.BytesIO()
+        fragments = io.StringIO()
+        yr = self.reader(text)
+        yr.find(["PLANT", "TREE"]).writes_jsonl(jsonl, flush_size=100)
+        yr.find(["PLANT", "TREE"]).writes_xml(fragments)
+        yr.start(chunk_size=64)
+        lines = jsonl.getvalue().decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [d for d, _ in expected])
+        etree = yr.etree
+        written = etree.fromstring("<out>" + fragments.getvalue() + "</out>")
+        self.assertEqual(len(written), len(expected))
+        for element, (_, s) in zip(written, expected):
+            element.tail = None
+            self.assertEqual(etree.tostring(element, encoding="unicode"), s)
+
+        depth = 200 if self.use_lxml else 2000         # Over the recursion limit without lxml
+        deep = "<r>" + "<a>" * depth + "x" + "</a>" * depth + "</r>"
+        out = io.BytesIO()
+        yr = self.reader(deep)
+        yr.find("a", parent="r", keep_children=True).writes_jsonl(out)
+        yr.start()
+        self.assertEqual(out.getvalue(), b'{"a":' * depth + b'"x"' + b'}' * depth + b"\n")
+
+        from yax.writers import Sink
+
+        class NoEncode(Sink):
+            pass
+        with self.assertRaises(TypeError):                  # Not in the middle of a parse
+            NoEncode(io.StringIO())
+
+    def test_shared_conversions(self):
+        converted = []
+        original = CallbackRunner.CONVERT_DICT[CallbackRunner.JSON_DICT]
+
+        def counting(element):
+            converted.append(element.get("id"))
+            return original(element)
+
+        calls = []
+        yr = self.reader()
+        runners = [yr.find("PLANT"), yr.find(["PLANT", "plant"]), yr.find(attrib={"id": "2"}),
+                   yr.find("PLANT"), yr.find("PLANT"), yr.find("PLANT")]
+        for i, runner in enumerate(runners[:3]):
+            runner.converts(CallbackRunner.JSON_DICT)
+            runner._convert = counting
+            runner.calls(lambda e, l, i=i: calls.append((i, e)))
+        runners[3].converts(CallbackRunner.STRING).calls(lambda e, l: calls.append((3, e)))
+        runners[4].converts(CallbackRunner.STRING).calls(lambda e, l: calls.append((4, e)))
+        runners[5].calls(lambda e, l: calls.append((5, e)))
+        yr.start()
+        self.assertEqual(converted, ["1", "2", "3"])
+        self.assertEqual([i for i, _ in calls], [0, 1, 3, 4, 5, 0, 1, 2, 3, 4, 5, 1])
+        self.assertIs(calls[0][1], calls[1][1])
+        self.assertIs(calls[5][1], calls[7][1])
+        self.assertIsNot(calls[0][1], calls[5][1])
+        self.assertIs(calls[2][1], calls[3][1])
+        self.assertIsInstance(calls[2][1], str)
+        self.assertEqual(calls[0][1], {"PLANT": {"-id": "1"}})     # The children are pruned
+
+    def test_bounded_tree(self):
+        records = "".join('<rec id="{0}"><v>{0}</v><!-- c --><w><x/></w></rec><junk><j/></junk>'
+                          .format(i) for i in range(500))
+        text = "<root><head>h</head><list>" + records + "</list><!-- end --></root>"
+        sizes = []
+
+        def size(e, l):
+            root = e.getroottree().getroot() if self.use_lxml else None
+            if root is not None:
+                sizes.append(sum(1 for _ in root.iter()))
+
+        for tag_filter in (DispatchTable.tag_filter, lambda table: None):
+            results = []
+            sizes.clear()
+            yr = self.reader(text)
+            yr.find("rec", {"id": re.compile("[0-9]*7")}).converts(CallbackRunner.STRING)\
+                .calls(lambda e, l: results.append(e))
+            yr.find("v").calls(size)
+            yr.find(["w", "head"]).converts(CallbackRunner.JSON_DICT)\
+                .calls(lambda e, l: results.append(e))
+            original = DispatchTable.tag_filter
+            DispatchTable.tag_filter = tag_filter
+            try:
+                yr.start(chunk_size=100)
+            finally:
+                DispatchTable.tag_filter = original
+            if tag_filter is original:
+                expected = results
+            else:
+                self.assertEqual(results, expected)
+            self.assertEqual(len(results), 1 + 50 + 500)
+            self.assertLess(max(sizes, default=0), 30)      # Not growing with the records
+
+        # Sparse matches: the records between them are not reported, but they are dropped too
+        for tag_filter in (DispatchTable.tag_filter, lambda table: None):
+            sizes.clear()
+            yr = self.reader(text.replace("<!-- end -->", "<last><v/></last>"))
+            yr.find("head").calls(lambda e, l: None)
+            yr.find("last").calls(lambda e, l: size(e, l))
+            original = DispatchTable.tag_filter
+            DispatchTable.tag_filter = tag_filter
+            try:
+                yr.start(chunk_size=100)
+            finally:
+                DispatchTable.tag_filter = original
+            self.assertLess(max(sizes, default=0), 30)
+
+    def test_stats(self):
+        reports = []
+        yr = self.reader()
+        plant = yr.find(["PLANT", "plant"], keep_children="PRICE")\
+            .converts(CallbackRunner.JSON_DICT).calls(lambda e, l: None)
+        yr.find("PRICE", text=re.compile(r"\$9.*")).converts(CallbackRunner.JSON_DICT)\
+            .calls(lambda e, l: time.sleep(0.01))
+        callback = plant._callback
+        stats = yr.collect_stats(reports.append, interval=0)
+        yr.start(chunk_size=100)
+        snapshot = stats.snapshot()
+        self.assertEqual(reports[-1], snapshot)
+        self.assertGreater(len(reports), 2)
+        self.assertEqual(snapshot["bytes"], len(CATALOG))
+        self.assertEqual(snapshot["elements"], 13)
+        self.assertGreaterEqual(snapshot["retained_max"], 3)
+        plants, prices = snapshot["conditions"]
+        self.assertEqual((plants["tag"], plants["checks"], plants["matches"]),
+                         ("['PLANT', 'plant']", 3, 3))
+        self.assertEqual((prices["checks"], prices["matches"]), (4, 2))
+        self.assertEqual([(r["calls"], r["conversions"]) for r in snapshot["runners"]],
+                         [(3, 3), (2, 2)])
+        self.assertGreaterEqual(snapshot["runners"][1]["callback_time"], 0.02)
+        self.assertIs(plant._callback, callback)                # Restored after the parse
+
+    def test_concurrent_backends(self):
+        shared = Condition(["PLANT", "plant"], children=Condition("PRICE", text=re.compile(
+            r"\$[0-9]\..*")), parent=Condition("CATALOG", {"name": "first"}))
+        readers = [YAXReader(io.StringIO(CATALOG), use_lxml=use_lxml)
+                   for use_lxml in (True, False, self.use_lxml)]
+        for yr in readers:
+            yr.match(shared)
+            yr.find("COMMON", parent=("PLANT", {"id": "2"}))
+        rows = list(zip(*readers))                  # The parses run together
+        for column in zip(*rows):
+            self.assertEqual([e.get("id") or e.text for e, l in column],
+                             ["1", "Columbine", "2", "3"])
+        self.assertEqual(readers[0].lxml_in_use(), True)
+        self.assertEqual(readers[1].lxml_in_use(), False)
+        # The deprecated class-level aliases tell the back-end of the last created reader
+        self.assertIs(YAXReader.etree, readers[2].etree)
+        self.assertEqual(Condition.LXML, readers[2].lxml)
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(YAXReader.lxml_in_use(), readers[2].lxml)
+
+        def parse(use_lxml):
+            found = []
+            yr = YAXReader(io.StringIO(CATALOG), use_lxml=use_lxml)
+            yr.match(shared).converts(CallbackRunner.STRING).calls(lambda e, l: found.append(e))
+            yr.start(chunk_size=16)
+            return len(found)
+
+        with yax_reader.ThreadPoolExecutor(4) as ex:
+            self.assertEqual(list(ex.map(parse, [True, False] * 8)), [3] * 16)
+
+    def test_calls_batch(self):
+        text = "<root>" + "".join('<rec id="{0}">{0}</rec>'.format(i) for i in range(25)) + \
+               "</root>"
+        batches = []
+        yr = self.reader(text)
+        yr.find("rec").converts(CallbackRunner.STRING).calls_batch(batches.append, size=10)
+        yr.start(chunk_size=64)
+        self.assertEqual([len(b) for b in batches], [10, 10, 5])     # The rest at the end
+        self.assertEqual([int(re.search(r'id="(\d+)"', e).group(1)) for b in batches
+                          for e, l in b], list(range(25)))
+        self.assertIsInstance(batches[0][0][1], int)
+
+        batches.clear()
+        yr = self.reader(text)
+        yr.find("rec").converts(CallbackRunner.STRING).calls_batch(batches.append, size=100,
+                                                                   max_bytes=100)
+        yr.start()
+        self.assertEqual(sum(len(b) for b in batches), 25)
+        for b in batches[:-1]:
+            sizes = [len(e) for e, l in b]
+            self.assertGreaterEqual(sum(sizes), 100)
+            self.assertLess(sum(sizes[:-1]), 100)
+
+        batches.clear()
+        yr = self.reader(text)
+        yr.find("rec").calls_batch(batches.append, size=100, max_latency=0)
+        yr.start()
+        self.assertEqual(len(batches), 25)
+        self.assertEqual([b[0][0].text for b in batches], [str(i) for i in range(25)])
+        with self.assertRaises(Exception):
+            yr.find("rec").calls_batch(batches.append, size=0)
+
+    def test_limits(self):
+        records = "".join('<rec id="{0}"><v>{0}</v></rec>'.format(i) for i in range(2000))
+        text = "<root><head>h</head>" + records + "</root>"
+
+        class Stream(io.StringIO):
+            read_size = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                self.read_size += len(data)
+                return data
+
+        def reader():
+            yr = YAXReader(Stream(text), use_lxml=self.use_lxml)
+            return yr, yr.stream
+
+        found = []
+        yr, stream = reader()
+        yr.find("head").calls(lambda e, l: found.append(e.text), limit=1)
+        yr.find("rec").calls(lambda e, l: found.append(e.get("id")), limit=3)
+        yr.start(chunk_size=256)
+        self.assertEqual(found, ["h", "0", "1", "2"])
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.read_size, 1024)             # Stopped when both were exhausted
+
+        found = []
+        yr, stream = reader()
+        yr.find("head").calls(lambda e, l: found.append(e.text), limit=1)
+        yr.find("v").calls(lambda e, l: found.append(e.text) or
+                           (YAXReader.STOP if e.text == "5" else None))
+        yr.start(chunk_size=256)
+        self.assertEqual(found, ["h", "0", "1", "2", "3", "4", "5"])
+        self.assertTrue(stream.closed)
+        self.assertLess(stream.read_size, 1024)
+
+        yr, stream = reader()
+        yr.find("rec").calls(lambda e, l: yr.stop() if e.get("id") == "3" else None)
+        yr.find("v").calls(lambda e, l: found.append(e.text))
+        found = []
+        self.assertEqual([e.get("id") for e, l in yr.iterfind("rec", chunk_size=256)],
+                         ["0", "1", "2"])                   # Not passed to the later runners
+        self.assertEqual(found, ["0", "1", "2", "3"])
+        self.assertLess(stream.read_size, 1024)
+
+        with self.assertRaises(Exception):
+            yr.find("rec").calls(lambda e, l: None, limit=0)
+
+    def test_aggregate(self):
+        from yax import attr, text, text_float, count
+        text_ = """<shop>
+            <item category="a"><name>x</name><price>2.5</price><info><stock>3</stock></info></item>
+            <item category="b"><name>y</name><price>10</price><info><stock>1</stock></info></item>
+            <item category="a"><name>z</name><price>n/a</price></item>
+            <item category="a"><price>4</price><info><stock>7</stock></info></item>
+            <item><price>1</price><tag/><tag/></item>
+        </shop>"""
+        yr = self.reader(text_)
+        by_category = yr.find("item").aggregate(key=attr("category"), sum=text_float("price"),
+                                                min=text_float("price"),
+                                                max=text_float("info/stock"))
+        yr.find("item", children="tag").aggregate(sum=count("tag"))
+        names = []
+        yr.find("name").calls(lambda e, l: names.append(e.text))
+        yr.find("shop").aggregate(key=text("missing"))
+        results = yr.start()
+        self.assertEqual(results[0], {"a": {"count": 3, "sum": 6.5, "min": 2.5, "max": 7.0},
+                                      "b": {"count": 1, "sum": 10.0, "min": 10.0, "max": 1.0},
+                                      None: {"count": 1, "sum": 1.0, "min": 1.0, "max": None}})
+        self.assertEqual(results[1:], [{"count": 1, "sum": 2}, {None: {"count": 1}}])
+        self.assertEqual(names, ["x", "y", "z"])
+        self.assertIsInstance(by_category._callback, yax_reader.Aggregator)
+        self.assertEqual(yr.find("item").calls(lambda e, l: None)._needs, ())
+
+        yr = self.reader()
+        yr.find("CATALOG").aggregate(sum=count("*/PRICE"))
+        self.assertEqual(yr.start(), [{"count": 1, "sum": 4}])
+        # Each parse starts from zero and returns its own results
+        yr.stream = io.StringIO(CATALOG)
+        self.assertEqual(asyncio.run(yr.start_async()), [{"count": 1, "sum": 4}])
+        yr.stream = io.StringIO(CATALOG)
+        self.assertEqual(list(yr), [])
+        self.assertEqual(yr._results(), [{"count": 1, "sum": 4}])
+        from yax import process_files
+        with self.assertRaises(Exception):
+            next(process_files([], lambda: yr))
+        self.assertIsNone(self.reader().start())
+        with self.assertRaises(Exception):
+            text("a//b")
+
+    def test_project(self):
+        from yax import count
+        text_ = "<shop>" + "".join(
+            '<item id="{0}"><name>n{0}</name><price cur="EUR">{1}</price><big>{2}</big>'
+            '<tags><tag/><tag/></tags></item>'.format(i, i * 1.5 if i != 2 else "?", "x" * 100)
+            for i in range(4)) + "</shop>"
+        records = []
+        retained = []
+
+        def record(r, l):
+            records.append(r)
+
+        yr = self.reader(text_)
+        yr.find("item").project({"id": ("@id", int), "name": "name", "price": ("price", float),
+                                 "currency": "price/@cur", "tags": count("tags/tag"),
+                                 "tag": "."}).calls(record)
+        yr.find("item").calls(lambda e, l: retained.append([c.tag for c in e.iter()]))
+        yr.start()
+        self.assertEqual(records[1], (1, "n1", 1.5, "EUR", 2, None))
+        self.assertEqual(records[2].price, None)
+        self.assertEqual([r.id for r in records], [0, 1, 2, 3])
+        self.assertEqual(type(records[0]).__slots__, ())
+        self.assertEqual(retained[0], ["item", "name", "price", "tags", "tag", "tag"])
+
+        import pickle
+        self.assertEqual(pickle.loads(pickle.dumps(records[3])), records[3])
+        self.assertEqual(pickle.loads(pickle.dumps(records[3]))._fields, records[3]._fields)
+
+        records.clear()
+        yr = self.reader()
+        yr.find(["PLANT", "plant"]).project({"id": "@id", "common": "COMMON"}).calls(record)
+        yr.find("PRICE").calls(lambda e, l: None)
+        yr.start()
+        self.assertEqual([tuple(r) for r in records],
+                         [("1", "Hepatica"), ("2", "Columbine"), ("3", "Marsh Marigold")])
+        for spec in ({}, {"a b": "@x"}, {"a": "x/@"}, {"a": "x@y"}, {"a": 1}):
+            with self.assertRaises(Exception):
+                yr.find("x").project(spec)
+
+    def test_parallel(self):
+        import yax.parallel
+        records = "".join('\n  <f:record id="{0}" xml:lang="hu"><name>r{0}</name><v>{1}</v></f:record>'
+                          .format(i, i % 7) for i in range(300))
+        text = '<?xml version="1.0" encoding="utf-8"?>\n<f:feed xmlns:f="urn:feed" a="&quot;">' + \
+               '<f:head><name>head</name></f:head>' + records + '</f:feed>\n'
+        with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+
+        def run(limit=None, **kwargs):
+            calls = []
+            yr = YAXReader(open(f.name), use_lxml=self.use_lxml, positions=True)
+            yr.find("{urn:feed}record", {"id": re.compile("[0-9]*[02468]")},
+                    parent=("{urn:feed}feed", {"a": '"'}), children=("v", None, "3"))\
+                .converts(CallbackRunner.JSON_DICT).calls(lambda e, l: calls.append((e, repr(l))),
+                                                          limit=limit)
+            yr.find("name", parent="{urn:feed}head").converts(CallbackRunner.STRING)\
+                .calls(lambda e, l: calls.append((e, repr(l))))
+            yr.start(**kwargs)
+            self.assertTrue(yr.stream.closed)
+            return calls
+
+        range_size = yax.parallel.RANGE_SIZE
+        yax.parallel.RANGE_SIZE = 500
+        try:
+            serial = run()
+            self.assertEqual(len(serial), 22)
+            self.assertEqual(run(workers=3, record_tag="f:record"), serial)
+            self.assertEqual(sorted(map(str, run(workers=3, record_tag="f:record",
+                                                 ordered=False))), sorted(map(str, serial)))
+            self.assertEqual(run(limit=5, workers=3, record_tag="f:record"), serial[:6])
+        finally:
+            yax.parallel.RANGE_SIZE = range_size
+
+    def test_process_files(self):
+        from yax import process_files
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = []
+        for k in range(6):
+            paths.append(os.path.join(directory.name, "{}.xml".format(k)))
+            with open(paths[-1], "w") as f:
+                f.write("<root n='{}'>".format(k) + "".join(
+                    '<rec id="{}"><v>{}</v></rec>'.format(i, i % 3) for i in range(k * 40)) +
+                    "</root>")
+        factories = []
+
+        def factory():
+            factories.append(os.getpid())
+            yr = YAXReader(use_lxml=self.use_lxml)
+            yr.find("rec", children=("v", None, "1")).converts(CallbackRunner.JSON_DICT)\
+                .calls(lambda e, l: None, limit=5)
+            yr.find("root").converts(CallbackRunner.STRING)
+            return yr
+
+        serial = list(process_files(paths, factory, workers=1))
+        self.assertEqual(len(serial), 6 + sum(min(5, k * 40 // 3) for k in range(6)))
+        self.assertEqual(serial[0][:2], (paths[0], 1))
+        self.assertEqual(serial[0][2].replace(" />", "/>"), '<root n="0"/>')
+        self.assertEqual(serial[2], (paths[1], 0, {"rec": {"-id": "4", "v": "1"}}, 0))
+        self.assertEqual(list(process_files(paths, factory, workers=3)), serial)
+        self.assertEqual(sorted(map(str, process_files(iter(paths), factory, workers=3,
+                                                       ordered=False))),
+                         sorted(map(str, serial)))
+        self.assertEqual(factories, [os.getpid()] * 3)      # Once per call in this process
+
+    def test_positions(self):
+        text = CATALOG.replace("Oak", "Tölgy")
+        data = text.encode()
+        found = []
+        yr = YAXReader(io.StringIO(text), use_lxml=self.use_lxml, positions=True)
+        yr.find(["TREE", "PRICE"]).calls(lambda e, l: found.append(l))
+        yr.start(chunk_size=16)
+        self.assertEqual([int(l) for l in found], [5, 9, 13, 17, 15])
+        self.assertIsInstance(found[0], Position)
+        if not self.use_lxml:
+            tree = found[-1]
+            self.assertEqual(tree.end_line, 18)
+            self.assertEqual(data[tree.start_byte:tree.end_byte],
+                             data[data.index(b'<TREE'):data.index(b'</TREE>') + 7])
+            price = found[0]
+            self.assertEqual(data[price.start_byte:price.end_byte], b"<PRICE>$4.45</PRICE>")
+
+        found = []
+        yr = YAXReader(io.StringIO("<a>\n<b/>\n<b x='/>'/><b></b></a>"), use_lxml=self.use_lxml,
+                       positions=True)
+        yr.find("b").calls(lambda e, l: found.append(l))
+        yr.start()
+        self.assertEqual([int(l) for l in found], [2, 3, 3])
+        if not self.use_lxml:
+            self.assertEqual([(l.start_byte, l.end_byte) for l in found],
+                             [(4, 8), (9, 20), (20, 27)])
+
+        found = []
+        yr = self.reader()
+        yr.find("PRICE").calls(lambda e, l: found.append(l))
+        yr.start()
+        self.assertEqual(found, [0] * 4)
+
+    def test_checkpoint_resume(self):
+        records = "".join('\n  <f:rec id="{0}"><name>ő{0}</name></f:rec>'.format(i) for i in range(20))
+        text = '<?xml version="1.0" encoding="utf-8"?>\n<f:feed xmlns:f="urn:feed" xmlns="urn:d" ' + \
+               'a="1"><f:head/>' + records + '\n</f:feed>\n'
+        with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False, encoding="utf-8",
+                                         newline="\r\n") as f:
+            f.write(text)                               # The offsets differ in a text stream
+        self.addCleanup(os.remove, f.name)
+
+        def reader(mode, calls):
+            yr = YAXReader(open(f.name, mode), use_lxml=self.use_lxml, positions=True)
+            yr.find("{urn:d}name", parent=("{urn:feed}rec", None, None,
+                                           ("{urn:feed}feed", {"a": "1"}))).calls(
+                lambda e, l: calls.append((e.text, repr(l))))
+            yr.find("{urn:feed}rec").aggregate()
+            return yr
+
+        with self.assertRaises(Exception):
+            reader("r", []).start(on_checkpoint=lambda cp: None)
+        with self.assertRaises(Exception):
+            reader("r", []).resume(Checkpoint(0, 1, []))
+        calls = []
+        checkpoints = []
+        yr = reader("rb", calls)
+        if self.use_lxml:
+            with self.assertRaises(Exception):
+                yr.start(on_checkpoint=checkpoints.append, checkpoint_interval=0)
+            return
+        self.assertEqual(yr.start(chunk_size=64, on_checkpoint=checkpoints.append,
+                                  checkpoint_interval=0), [{"count": 20}])
+        self.assertEqual(len(calls), 20)
+        self.assertEqual(len(checkpoints), 21)          # f:head and the records
+        cp = Checkpoint.from_json(checkpoints[8].to_json())
+        self.assertEqual(cp.ancestors, [("{urn:feed}feed", {"a": "1"},
+                                         [("f", "urn:feed"), ("", "urn:d")])])
+        resumed = []
+        self.assertEqual(reader("rb", resumed).resume(cp, chunk_size=64), [{"count": 13}])
+        self.assertEqual(resumed, calls[7:])
+
+    def test_start_async(self):
+        class AsyncStream:
+            def __init__(self, text):
+                self._stream = io.StringIO(text)
+                self.reads = 0
+
+            async def read(self, size):
+                self.reads += 1
+                await asyncio.sleep(0)
+                return self._stream.read(size)
+
+        running = [0, 0]                                # current, maximum
+        found = []
+
+        async def slow(e, l):
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.001)
+            running[0] -= 1
+            found.append(e.text)
+
+        stream = AsyncStream(CATALOG)
+        yr = YAXReader(use_lxml=self.use_lxml)
+        yr.find("COMMON").calls(slow)
+        yr.find("TREE").calls(lambda e, l: found.append(e.tag))
+        asyncio.run(yr.start_async(stream, chunk_size=32, max_tasks=2))
+        self.assertEqual(sorted(found), ["Columbine", "Hepatica", "Marsh Marigold", "Oak", "TREE"])
+        self.assertGreater(stream.reads, 10)
+        self.assertEqual(running, [0, 2])
+
+        async def failing(e, l):
+            raise ValueError(e.text)
+
+        yr = YAXReader(use_lxml=self.use_lxml)
+        yr.find("COMMON").calls(failing)
+        with self.assertRaises(ValueError):
+            asyncio.run(yr.start_async(AsyncStream(CATALOG), max_tasks=1))
+
+    def test_threaded_callbacks(self):
+        lock = threading.Lock()
+        found = []
+        threads = set()
+
+        def slow(e, l):
+            time.sleep(0.002)
+            with lock:
+                found.append(e["PLANT"]["COMMON"] if isinstance(e, dict) else e)
+                threads.add(threading.get_ident())
+
+        text = "<CATALOG>" + "".join("<PLANT><COMMON>{}</COMMON><PRICE/></PLANT>tail".format(i)
+                                     for i in range(50)) + "</CATALOG>"
+        yr = self.reader(text)
+        yr.find("PLANT", keep_children="COMMON").converts(CallbackRunner.JSON_DICT)\
+            .calls(slow, threads=4, queue_size=2)
+        yr.find("PLANT").converts(CallbackRunner.STRING).calls(slow, threads=2)
+        yr.start()
+        self.assertEqual(sorted(found[i] for i in range(100) if not found[i].startswith("<")),
+                         sorted(str(i) for i in range(50)))
+        self.assertGreater(len(threads), 1)
+        self.assertNotIn(threading.get_ident(), threads)
+
+        def failing(e, l):
+            raise ValueError(e.tag)
+
+        yr = self.reader(text)
+        yr.find("PLANT").calls(failing, threads=2)
+        with self.assertRaises(ValueError):
+            yr.start()
+        self.assertTrue(yr.stream.closed)
+
+    def test_binary_stream(self):
+        text = CATALOG.replace('<?xml version="1.0"?>', '<?xml version="1.0" encoding="iso-8859-2"?>')\
+            .replace("Oak", "Tölgy")
+        found = []
+        yr = YAXReader(io.BytesIO(text.encode("iso-8859-2")), use_lxml=self.use_lxml)
+        yr.find("COMMON").calls(lambda e, l: found.append(e.text))
+        yr.start(chunk_size=7)
+        self.assertEqual(found, ["Hepatica", "Columbine", "Marsh Marigold", "Tölgy"])
+
+    def test_compressed(self):
+        import gzip
+        import bz2
+        import lzma
+        text = ("<root>" + "".join('<rec id="{0}"><v>{1}</v></rec>'.format(i, "x" * (i % 50))
+                                   for i in range(3000)) + "</root>").encode()
+        half = len(text) // 2
+        inputs = {"gzip": gzip.compress(text[:half]) + gzip.compress(text[half:]),   # 2 members
+                  "bz2": bz2.compress(text), "xz": lzma.compress(text)}
+        threads = threading.active_count()
+        for name, data in inputs.items():
+            self.assertEqual(yax_reader.compression(data), name)
+            for chunk_size in (None, 10, 1 << 20):
+                found = []
+                yr = YAXReader(io.BytesIO(data), use_lxml=self.use_lxml)
+                yr.find("rec").calls(lambda e, l: found.append(e.get("id")))
+                yr.start(chunk_size)
+                self.assertEqual(found, [str(i) for i in range(3000)])
+                self.assertTrue(yr.stream.closed)
+
+            yr = YAXReader(io.BytesIO(data), use_lxml=self.use_lxml)
+            yr.find("rec").calls(lambda e, l: None, limit=3)
+            yr.start(100)
+            with self.assertRaises(Exception):
+                YAXReader(io.BytesIO(data[:len(data) // 2]), use_lxml=self.use_lxml).start()
+        time.sleep(0.3)
+        self.assertEqual(threading.active_count(), threads)       # The threads are stopped
+        self.assertIsNone(yax_reader.compression(text))
+        self.assertIsNone(yax_reader.compression("<root/>"))
+
+        import yax.compressed
+        chunks = list(yax.compressed.decompress("gzip", [gzip.compress(b"a" * 10000000)]))
+        self.assertEqual(sum(map(len, chunks)), 10000000)
+        self.assertLessEqual(max(map(len, chunks)), yax.compressed.CHUNK_SIZE)
+
+    def test_adaptive_chunks(self):
+        sizes = []
+
+        class Stream(io.BytesIO):
+            def read(self, size=-1):
+                sizes.append(size)
+                return super().read(size)
+
+            def readinto(self, buf):
+                sizes.append(len(buf))
+                return super().readinto(buf)
+
+        text = "<a>" + "<b>x</b>" * 100000 + "</a>"
+        yr = YAXReader(Stream(text.encode()), use_lxml=self.use_lxml)
+        yr.find("b")
+        yr.start()
+        window = yax_reader.CHUNK_WINDOW
+        self.assertEqual(sizes[:window], [yax_reader.CHUNK_SIZE_START] * window)
+        self.assertEqual(sizes[window], yax_reader.CHUNK_SIZE_START * 2)
+        self.assertTrue(all(yax_reader.CHUNK_SIZE_MIN <= s <= yax_reader.CHUNK_SIZE_MAX
+                            for s in sizes))
+        sizes.clear()
+        YAXReader(Stream(text.encode()), use_lxml=self.use_lxml).start(chunk_size=5000)
+        self.assertEqual(set(sizes), {5000})
+
+    def test_from_path(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False, encoding="utf-8") as f:
+            f.write(CATALOG.replace("Oak", "Tölgy"))
+        self.addCleanup(os.remove, f.name)
+        for mmap in (True, False):
+            found = []
+            yr = YAXReader.from_path(f.name, use_lxml=self.use_lxml, positions=True, mmap=mmap)
+            yr.find("PRICE", text="$99.00").calls(lambda e, l: found.append(l))
+            yr.find("COMMON").calls(lambda e, l: found.append(e.text))
+            yr.start(chunk_size=10)
+            self.assertEqual(found[-2:], ["Tölgy", found[-1]])
+            self.assertTrue(yr.stream.closed)
+            if not self.use_lxml:
+                self.assertEqual(yr.reread(found[-1]), b"<PRICE>$99.00</PRICE>")
+            if mmap:
+                yr.stream.release()
+
+        if not self.use_lxml:
+            with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False, encoding="utf-8",
+                                             newline="\r\n") as f:
+                f.write(CATALOG)
+            self.addCleanup(os.remove, f.name)
+            for stream in (io.StringIO(CATALOG), open(f.name, "r"), io.BytesIO(CATALOG.encode())):
+                found = []
+                yr = YAXReader(stream, positions=True)
+                yr.find("PRICE").calls(lambda e, l: found.append(l))
+                yr.start()
+                with self.assertRaises(Exception):
+                    yr.reread(found[0])
+            found = []
+            yr = YAXReader(open(f.name, "rb"), positions=True)
+            yr.find("PRICE").calls(lambda e, l: found.append(l))
+            yr.start()
+            self.assertEqual(yr.reread(found[0]), b"<PRICE>$4.45</PRICE>")
+
+        with tempfile.NamedTemporaryFile("w", suffix=".xml", delete=False) as f:
+            pass
+        self.addCleanup(os.remove, f.name)
+        yr = YAXReader.from_path(f.name, use_lxml=self.use_lxml)
+        self.assertEqual(yr.stream.read(10), b"")
+
+
+class YAXReaderLxmlTest(YAXReaderTest):
+
+    use_lxml = True
+
+
+if __name__ == '__main__':
+    unittest.main()
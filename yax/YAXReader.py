@@ -1,7 +1,23 @@
+import io
 import re
+import copy
+import time
+import asyncio
+import threading
 import inspect
-from .condition import Condition
+import itertools
+import collections
+from .condition import Condition, ConditionException, EmptyCondition, EvalContext, lxml_element
+from .position import Position, PositionParser, Checkpoint, line_position
+from .mapped import MappedStream
+from .writers import JsonlSink, XmlSink, FLUSH_SIZE
+from .compressed import DecompressingStream, compression
+from .path import PathTracker
+from .aggregate import Aggregator
+from .projection import Projection
+from .stats import Stats
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 __author__ = 'Móréh, Tamás'
 
@@ -9,9 +25,19 @@ __author__ = 'Móréh, Tamás'
 # Type of compiled regexes
 RE = type(re.compile(""))
 
+# Limits of the adaptive chunk size and the number of chunks measured before changing it.
+CHUNK_SIZE_START = 1 << 15
+CHUNK_SIZE_MIN = 1 << 12
+CHUNK_SIZE_MAX = 1 << 20
+CHUNK_WINDOW = 16
+
 
 def element_to_string(element, encoding="unicode", method="xml", **kwargs):
-    return YAXReader.etree.tostring(element, encoding=encoding, method=method, **kwargs)
+    if lxml_element(element):
+        import lxml.etree as etree
+    else:
+        import xml.etree.ElementTree as etree
+    return etree.tostring(element, encoding=encoding, method=method, **kwargs)
 
 
 def element_to_cmplx_dict(element):
@@ -98,16 +124,14 @@ class CallbackRunner:
     def __init__(self, t: int, attrib_prefix='-', text_prefix='#', condition: Condition=None):
         self.condition = condition
         self._callback = CallbackRunner._default
-        self._type = t
+        self._pool = None
+        self._sink = None
+        self._limit = None              # Maximum number of the matches passed in a parse
+        self._needs = ()                # Child paths kept for the callback (see DispatchTable)
+        self._prefixes = (attrib_prefix, text_prefix)
         CallbackRunner.ATTRIB_PREFIX = attrib_prefix
         CallbackRunner.TEXT_PREFIX = text_prefix
-        try:
-            self._convert = CallbackRunner.CONVERT_DICT[t]
-        except KeyError as e:
-            e.args = ("CallbackRunner type must be one of CallbackRunner.ETREE, " +
-                      "CallbackRunner.STRING, CallbackRunner.JSON_DICT and " +
-                      "CallbackRunner.DICT!",)
-            raise
+        self.converts(t)
 
     def inverted(self) -> Condition:
         warnings.warn("This feature is waiting for a better implementation", FutureWarning)
@@ -116,7 +140,16 @@ class CallbackRunner:
 
     # TODO itt kell megvalósítani a visszaírást
 
-    def calls(self, callback):
+    def calls(self, callback, threads: int=None, queue_size: int=None, limit: int=None):
+        """
+        Sets the callback.
+        :param threads: if it is given, the conversion and the callback run on a thread pool
+        with this many threads. The element is copied before, so the parser can prune it.
+        :param queue_size: maximum number of waiting calls in threaded mode (default:
+        4 * threads). When it is full, the parsing waits.
+        :param limit: the callback is called for the first limit matches only. When all the
+        CallbackRunners of the reader reached their limits, the parse stops.
+        """
         if not callable(callback):
             raise Exception("The callback argument must be callable!")
         ins = inspect.getfullargspec(callback)
@@ -124,79 +157,982 @@ class CallbackRunner:
             raise Exception("The callback funciton must can accept at least 2 arguments!\n" +
                             "First: The element itself, Second: the line number.")
         self._callback = callback
+        self._pool = CallbackPool(threads, queue_size or 4 * threads) if threads else None
+        self._sink = None
+        self._set_limit(limit)
+        return self
+
+    def _set_limit(self, limit):
+        if limit is not None and limit < 1:
+            raise Exception("The limit must be positive!")
+        self._limit = limit
+
+    def calls_batch(self, callback, size: int=1000, max_latency: float=None,
+                    max_bytes: int=None, limit: int=None):
+        """
+        Sets a callback which gets the matches in lists of (converted element, line number)
+        tuples instead of one by one (eg. for bulk inserts). The rest is passed at the end of the
+        parse.
+        :param size: maximum number of the matches in a batch
+        :param max_latency: the batch is passed when a match comes this many seconds after the
+        first match of the batch
+        :param max_bytes: the batch is passed when the total length of its str or bytes items
+        (eg. with the STRING converter) reaches this
+        :param limit: maximum number of the passed matches, see calls()
+        """
+        if not callable(callback):
+            raise Exception("The callback argument must be callable!")
+        if size < 1:
+            raise Exception("The batch size must be positive!")
+        self._callback = Batch(callback, size, max_latency, max_bytes)
+        self._pool = None
+        self._sink = self._callback
+        self._set_limit(limit)
+        return self
+
+    def aggregate(self, key=None, sum=None, min=None, max=None):
+        """
+        Counts the matches and sums the values or takes their minimum and maximum instead of
+        calling a callback. The values are taken from the elements by Extractors (see
+        yax.aggregate: attr, text, text_float, text_int, count) without converting them, and the
+        children needed by the Extractors are kept. start() returns the results.
+        :param key: Extractor of the group key, without it there is one group
+        :return: the CallbackRunner object itself
+        """
+        aggregator = Aggregator(key, sum, min, max)
+        self.converts(CallbackRunner.ETREE)
+        self._callback = aggregator
+        self._pool = None
+        self._sink = None
+        self._needs = kept_paths(e.path for e in aggregator.extractors() if e.path is not None)
+        return self
+
+    def writes_jsonl(self, fp, attrib_prefix="-", text_prefix="#", ensure_ascii=False,
+                     flush_size: int=FLUSH_SIZE):
+        """
+        Writes the matches to the file as JSON Lines (with the mapping of JSON_DICT) instead of
+        calling a callback. The elements are encoded without building dicts and the output is
+        written in batches of flush_size bytes. The rest is written at the end of the parse.
+        :param fp: binary (UTF-8 output) or text file
+        """
+        return self._writes(JsonlSink(fp, attrib_prefix, text_prefix, ensure_ascii, flush_size))
+
+    def writes_xml(self, fp, flush_size: int=FLUSH_SIZE):
+        """
+        Writes the matches to the file as XML fragments, one per line, instead of calling a
+        callback. The output is written in batches of flush_size bytes.
+        :param fp: binary (UTF-8 output) or text file
+        """
+        return self._writes(XmlSink(fp, flush_size))
+
+    def _writes(self, sink):
+        self._callback = sink
+        self._convert = sink.encode         # It runs in the workers at the parallel parsing
+        self._type = None
+        self._key = sink.key
+        self._pool = None
+        self._sink = sink
+        self._needs = ()
+        return self
+
+    def converts(self, t: int):
+        """
+        Sets the type which the element is converted to before passing to the callback.
+        :param t: CallbackRunner.ETREE, STRING, DICT or JSON_DICT
+        :return: the CallbackRunner object itself
+        """
+        try:
+            self._convert = CallbackRunner.CONVERT_DICT[t]
+        except KeyError as e:
+            e.args = ("CallbackRunner type must be one of CallbackRunner.ETREE, " +
+                      "CallbackRunner.STRING, CallbackRunner.JSON_DICT and " +
+                      "CallbackRunner.DICT!",)
+            raise
+        self._type = t
+        # The same conversions of an element are shared by the runners (not the elements).
+        self._key = None if t == CallbackRunner.ETREE else (t, ) + self._prefixes
+        self._needs = ()
+        return self
+
+    def project(self, spec: dict):
+        """
+        Converts the matched elements to records (namedtuples) of the values given by the spec
+        instead of the converters. Only the children used by the spec are kept by the parser
+        (besides the children and keep_children conditions).
+        :param spec: dict of the field names and their definitions: "." (text of the element),
+        "@name" (attribute), "a/b" (text of the first child at the path), "a/b/@name", an
+        Extractor (like yax.count("a")) or a (definition, type) tuple to convert the value (None
+        if it fails)
+        :return: the CallbackRunner object itself
+        """
+        projection = Projection(spec)
+        self._convert = projection
+        self._type = None
+        self._key = None
+        self._needs = kept_paths(projection.paths)
+        return self
 
-    def __call__(self, element, line: int=0):
+    def has_callback(self) -> bool:
+        return self._callback is not CallbackRunner._default
+
+    def convert(self, element, cache=None):
+        """
+        :param cache: ConversionCache of the current parse event, the element is converted only
+        once for the runners with the same converter
+        """
+        if cache is None or self._key is None:
+            return self._convert(element)
+        return cache.get(element, self._key, self._convert)
+
+    def call_converted(self, converted, line: int=0):
+        if self._pool is not None:
+            self._pool.submit(self._callback, converted, line)
+            return None
+        return self._callback(converted, line)
+
+    def join(self):
+        """
+        Waits for the threaded callbacks and raises their first exception, then writes the
+        buffered output of writes_jsonl() or writes_xml() or passes the last batch of
+        calls_batch().
+        """
+        if self._pool is not None:
+            self._pool.join()
+        if self._sink is not None:
+            self._sink.flush()
+
+    def _run(self, element, line):
         self._callback(self._convert(element), line)
 
+    def __call__(self, element, line: int=0, cache=None):
+        if self._pool is not None:
+            # The tail of the element can be set later by the parser, and lxml trees must not
+            # be used from more threads, so the callback gets a copy.
+            self._pool.submit(self._run, copy.deepcopy(element) if lxml_element(element)
+                              else copy.copy(element), line)
+            return None
+        return self._callback(self.convert(element, cache), line)
+
+
+class ConversionCache:
+    """
+    The converted forms of the current element keyed by the converter type and its options. The
+    runners matching the same element share them, so the callbacks must not modify them. The
+    values are dropped when an other element comes.
+    """
+    __slots__ = ("_element", "_values")
+
+    def __init__(self):
+        self._element = None
+        self._values = {}
+
+    def get(self, element, key, convert):
+        if element is not self._element:
+            self._element = element
+            self._values.clear()
+        try:
+            return self._values[key]
+        except KeyError:
+            self._values[key] = value = convert(element)
+            return value
+
+    def clear(self):
+        self._element = None
+        self._values.clear()
+
+
+class Batch:
+    """
+    Callback of calls_batch(): collects the (converted element, line) tuples and passes them to
+    the callback in a list when the size, the age of the first one or the total length of the
+    str and bytes items reaches the limit. flush() passes the rest.
+    """
+
+    def __init__(self, callback, size: int, max_latency: float=None, max_bytes: int=None):
+        self._callback = callback
+        self._size = size
+        self._max_latency = max_latency
+        self._max_bytes = max_bytes
+        self._items = []
+        self._bytes = 0
+        self._first = None          # Arrival time of the first item of the batch
+
+    def __call__(self, data, line=0):
+        items = self._items
+        items.append((data, line))
+        if len(items) >= self._size:
+            self.flush()
+            return
+        if self._max_bytes is not None and isinstance(data, (str, bytes, bytearray)):
+            self._bytes += len(data)
+            if self._bytes >= self._max_bytes:
+                self.flush()
+                return
+        if self._max_latency is not None:
+            now = time.monotonic()
+            if self._first is None:
+                self._first = now
+            if now - self._first >= self._max_latency:
+                self.flush()
+
+    def flush(self):
+        if self._items:
+            items, self._items = self._items, []
+            self._bytes = 0
+            self._first = None
+            self._callback(items)
+
+
+class CallbackPool:
+    """
+    Thread pool for the callbacks. At most queue_size calls can wait or run, after that
+    submit() blocks until one of them finishes. The first exception of the calls is raised by
+    the next submit() or by join().
+    """
+
+    def __init__(self, threads: int, queue_size: int):
+        self._threads = threads
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._error = None
+
+    def submit(self, fn, *args):
+        self._raise()
+        self._slots.acquire()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self._threads)
+        self._executor.submit(fn, *args).add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def join(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._raise()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+class DispatchTable:
+    """
+    Index of the registered (Condition, CallbackRunner) pairs by tag name.
+    Conditions with plain string (or list of strings) tag filters are reached only by their
+    tag names, the others (regexp, callable, None or inverted) are checked for all elements.
+    The merged lists keep the registration order, so the callbacks are called in the same order
+    as by checking all the conditions. The conditions are compiled for the back-end and the
+    lists contain their check and keep functions. The keep functions keep also the children
+    needed by the CallbackRunners (by aggregate() and project()).
+    """
+
+    def __init__(self, cnds: list, lxml: bool=False):
+        self._literal = {}      # tag -> [(index, cond, cb_runner), ...]
+        self._fallback = []
+        self._keep_literal = {}
+        self._keep_fallback = []
+        self.checks = []        # The check functions of the conditions by index
+        self.keeps = []
+        for i, (cond, cb_runner) in enumerate(cnds):
+            cond.compile(lxml)
+            self.checks.append(cond.checker(lxml))
+            names = getattr(cond, "_tag_names", None)
+            parent_names = set()            # The tags of the parents of the kept elements
+            if cb_runner._needs:
+                self.keeps.append(needs_keeper(cond, cb_runner._needs, lxml))
+                for path in cb_runner._needs:
+                    parent = path[-2] if len(path) > 1 else names
+                    if parent is None:
+                        names = None
+                        break
+                    parent_names |= {parent} if isinstance(parent, str) else parent
+            else:
+                self.keeps.append(cond.keeper(lxml))
+            if names is None:
+                self._keep_fallback.append((i, cond))
+            else:
+                for name in parent_names | names:
+                    self._keep_literal.setdefault(name, []).append((i, cond))
+            if names is None or getattr(cond, "_inverted", False):
+                self._fallback.append((i, cond, cb_runner))
+            else:
+                for name in names:
+                    self._literal.setdefault(name, []).append((i, cond, cb_runner))
+        self._handlers = {}
+        self._keepers = {}
+        self._cnds = cnds
+        # index -> number of the matches left for the runners with a limit
+        self._remaining = {i: cb_runner._limit for i, (_, cb_runner) in enumerate(cnds)
+                           if cb_runner._limit is not None}
+        self._indices = {id(cb_runner): i for i, (_, cb_runner) in enumerate(cnds)}
+        self._active = len(cnds)
+
+    def count(self, cb_runner) -> bool:
+        """
+        Counts a match of a CallbackRunner with a limit. When the limit is reached, its
+        condition is not checked any more.
+        :return: True if all the conditions reached their limits
+        """
+        i = self._indices[id(cb_runner)]
+        self._remaining[i] -= 1
+        if self._remaining[i] == 0:
+            self._active -= 1
+            self._fallback = [t for t in self._fallback if t[0] != i]
+            for name, entries in self._literal.items():
+                self._literal[name] = [t for t in entries if t[0] != i]
+            self._keep_fallback = [t for t in self._keep_fallback if t[0] != i]
+            for name, entries in self._keep_literal.items():
+                self._keep_literal[name] = [t for t in entries if t[0] != i]
+            self._handlers = {}
+            self._keepers = {}
+        return self._active == 0
+
+    def handlers(self, tag) -> list:
+        """
+        :param tag: tag name of the current element
+        :return: the (check function, CallbackRunner) pairs which can match an element with this
+        tag
+        """
+        try:
+            return self._handlers[tag]
+        except KeyError:
+            merged = sorted(self._literal.get(tag, []) + self._fallback, key=lambda t: t[0])
+            self._handlers[tag] = result = [(self.checks[i], cb_runner)
+                                            for i, _, cb_runner in merged]
+            return result
+
+    def tag_filter(self):
+        """
+        :return: the set of the tag names if only the elements with these tags can match and
+        nothing has to be kept (every condition has a plain string tag filter, it is not
+        inverted and it has no children or keep_children conditions), otherwise None
+        """
+        tags = set()
+        for cond, cb_runner in self._cnds:
+            if getattr(cond, "_tag_names", None) is None or cond._inverted or cond._children \
+                    or cond._keep or cb_runner._needs:
+                return None
+            tags |= cond._tag_names
+        return tags
+
+    def keepers(self, parent_tag) -> list:
+        """
+        :param parent_tag: tag name of the parent of the current element
+        :return: the keep functions of the conditions which can keep the children of an element
+        with this tag
+        """
+        try:
+            return self._keepers[parent_tag]
+        except KeyError:
+            merged = sorted(self._keep_literal.get(parent_tag, []) + self._keep_fallback,
+                            key=lambda t: t[0])
+            self._keepers[parent_tag] = result = [self.keeps[i] for i, _ in merged]
+            return result
+
+
+def kept_paths(paths) -> tuple:
+    """
+    :param paths: child paths (tuples of tag names) needed under the matched elements
+    :return: the paths and their prefixes (the ancestors of the needed children are kept too)
+    """
+    return tuple(dict.fromkeys(path[:k] for path in paths for k in range(1, len(path) + 1)))
+
+
+def needs_keeper(cond, needs: tuple, lxml: bool):
+    """
+    :param needs: child paths (tuples of tag names, None is *) under the elements matched by the
+    condition
+    :return: keep function of the condition which keeps also the elements at the paths. Like at
+    the keep_children conditions, only the tag names of the ancestors are checked.
+    """
+    keep = cond.keeper(lxml)
+    tag = cond._tag
+
+    def at_path(element, ancestors):
+        for path in needs:
+            k = len(path)
+            if path[-1] is not None and path[-1] != element.tag:
+                continue
+            tags = ancestors(k)
+            if len(tags) == k and tag(tags[-1]) and \
+                    all(name is None or name == t for name, t in zip(reversed(path[:-1]), tags)):
+                return True
+        return False
+
+    if lxml:
+        def keep_lxml(element, ctx=None):
+            def ancestors(k):
+                tags = []
+                node = element.getparent()
+                while node is not None and len(tags) < k:
+                    tags.append(node.tag)
+                    node = node.getparent()
+                return tags
+            return keep(element, ctx) or at_path(element, ancestors)
+        return keep_lxml
+
+    def keep_xml(element, parents, ctx=None):
+        return keep(element, parents, ctx) or \
+            at_path(element, lambda k: [p.tag for p in parents[:-k - 1:-1]])
+    return keep_xml
+
+
+class _LxmlInUse:
+    """
+    YAXReader.lxml_in_use: on a reader it tells its back-end. Called on the class (deprecated),
+    it tells the back-end of the last created reader like the earlier versions.
+    """
+
+    def __get__(self, reader, cls=None):
+        if reader is not None:
+            return lambda: reader.lxml
+
+        def lxml_in_use():
+            warnings.warn("YAXReader.lxml_in_use() is deprecated, the back-end belongs to the "
+                          "reader: call it on a YAXReader object.", DeprecationWarning, 2)
+            return Condition.LXML
+        return lxml_in_use
+
 
 class YAXReader:
-    etree = None  # todo példány szintre! (egyébként működik)
+    # A callback can return it to stop the parse (like stop()).
+    STOP = object()
+    # Deprecated: the etree module of the last created reader, use the etree attribute of the
+    # reader instead.
+    etree = None
 
-    def __init__(self, stream=None, use_lxml=False):
+    def __init__(self, stream=None, use_lxml=False, positions=False):
         self._cnds = []
+        self._stopped = False
         self.stream = stream
+        self.positions = positions      # Pass Position objects as line numbers to the callbacks
+        self.stats = None               # Stats object if collect_stats() is called
+        # The back-end belongs to the reader, so readers with different back-ends can run at the
+        # same time (the conditions are compiled for each back-end).
+        self.lxml = False
         if use_lxml:
             try:
                 import lxml.etree as etree
-                Condition.LXML = True
+                self.lxml = True
             except ImportError:
                 import xml.etree.ElementTree as etree
-                Condition.LXML = False
         else:
             import xml.etree.ElementTree as etree
-            Condition.LXML = False
-        YAXReader.etree = etree
+        self.etree = etree
+        YAXReader.etree = etree             # The deprecated class-level aliases
+        Condition.LXML = self.lxml
+
+    def collect_stats(self, on_report=None, interval: float=10.0) -> Stats:
+        """
+        Turns on the statistics of the parses: the check calls, matches and check time of the
+        conditions, the calls and the callback and converter times of the CallbackRunners, the
+        fed bytes, the seen elements and the maximum of the retained elements. Without it the
+        parse is not slowed down at all.
+        :param on_report: called with a snapshot dict in every interval seconds and at the end
+        :return: the Stats object, see its snapshot() method
+        """
+        self.stats = Stats(on_report, interval)
+        return self.stats
+
+    lxml_in_use = _LxmlInUse()
+
+    def stop(self):
+        """
+        Stops the current parse after the current match (or chunk): the reading stops, the
+        stream is closed and start() returns normally. It can be called from the callbacks and
+        from other threads.
+        """
+        self._stopped = True
 
     @staticmethod
-    def lxml_in_use():
-        return Condition.LXML
+    def from_path(path, use_lxml=False, positions=False, mmap=True):
+        """
+        Creates a YAXReader which reads a file in binary mode.
+        :param mmap: the file is memory-mapped and the parser gets slices of the mapping without
+        copying (with lxml the slices are copied to bytes objects)
+        """
+        yr = YAXReader(None, use_lxml, positions)
+        yr.stream = MappedStream(path, as_bytes=yr.lxml) if mmap else open(path, "rb")
+        return yr
+
+    def reread(self, position: Position) -> bytes:
+        """
+        Reads the source of a matched subtree again by its Position (with positions=True on the
+        built-in xml backend). It works also after the parse if the reader is created by
+        from_path(). The stream must be memory-mapped or a binary file: the offsets of a text
+        stream are counted in the decoded text, so they can differ from the offsets in the file.
+        """
+        if position.start_byte is None or position.end_byte is None:
+            raise Exception("The byte offsets of the position are unknown.")
+        if isinstance(self.stream, MappedStream):
+            return self.stream.slice(position.start_byte, position.end_byte)
+        if isinstance(self.stream, io.TextIOBase):
+            raise Exception("A text stream cannot be reread by byte offsets, use from_path() or "
+                            "a binary file.")
+        if not isinstance(getattr(self.stream, "name", None), (str, bytes)):
+            raise Exception("Only a file can be reread, the stream has no file name.")
+        with open(self.stream.name, "rb") as f:
+            f.seek(position.start_byte)
+            return f.read(position.end_byte - position.start_byte)
+
+    def start(self, chunk_size=None, workers: int=None, record_tag: str=None, ordered=True,
+              on_checkpoint=None, checkpoint_interval=1 << 26, checkpoint_depth=1):
+        """
+        Performs the analysis and closes the stream at the end of that.
+        :param chunk_size: size of the chunks read from the stream, adaptive if it is None
+        :param workers: if it is greater than 1, the file is split into byte ranges at the start
+        tags of the records and they are parsed in this many processes. The callbacks are called
+        in this process with the converted subtrees.
+        :param record_tag: the tag name of the repeated records as it is written in the file,
+        required by the parallel parsing
+        :param ordered: the parallel parsing calls the callbacks in the document order
+        :param on_checkpoint: called with a Checkpoint object at the start of a record (an
+        element at checkpoint_depth) when checkpoint_interval bytes passed since the last one.
+        The parse can be continued from it by resume().
+        :return: the results of the CallbackRunners with aggregate() in the registration order
+        or None if there are not any (see _results())
+        """
+        if workers is not None and workers > 1:
+            if on_checkpoint is not None:
+                raise Exception("Checkpoints are not supported by the parallel parsing.")
+            if not record_tag:
+                raise Exception("Parallel parsing needs the record_tag argument.")
+            if not self.stream:
+                raise Exception("Input stream is not initialized.")
+            elif self.stream.closed:
+                raise Exception("The input stream is closed.")
+            if self.lxml and any(cb_runner.has_callback() and
+                                      cb_runner._type == CallbackRunner.ETREE
+                                      for _, cb_runner in self._cnds):
+                raise Exception("The lxml elements cannot be passed between processes, " +
+                                "use a STRING, DICT or JSON_DICT converter.")
+            from .parallel import start_parallel
+            for aggregator in self._aggregators():  # _matches() runs in the workers
+                aggregator.reset()
+            start_parallel(self, record_tag, workers, ordered, chunk_size)
+            return self._results()
+        cache = ConversionCache()
+        for cb_runner, element, line in self._matches(chunk_size, on_checkpoint,
+                                                      checkpoint_interval, checkpoint_depth):
+            if cb_runner(element, line, cache) is YAXReader.STOP:
+                self._stopped = True
+        cache.clear()
+        return self._results()
 
-    def start(self, chunk_size=8192):
-        if not self.stream:
+    def _aggregators(self) -> list:
+        """
+        :return: the Aggregators of the CallbackRunners (see CallbackRunner.aggregate())
+        """
+        return [cb_runner._callback for _, cb_runner in self._cnds
+                if isinstance(cb_runner._callback, Aggregator)]
+
+    def _results(self):
+        """
+        :return: the results of the Aggregators of the last parse or None if there are not any.
+        They are reset at the start of each parse.
+        """
+        aggregators = self._aggregators()
+        return [a.result() for a in aggregators] if aggregators else None
+
+    def resume(self, checkpoint: Checkpoint, chunk_size=None, on_checkpoint=None,
+               checkpoint_interval=1 << 26, checkpoint_depth=1):
+        """
+        Continues an interrupted analysis from a checkpoint given by start(). The stream is
+        seeked to the checkpoint's offset, the ancestors are rebuilt for the parent conditions and
+        only the records after the checkpoint are passed to the callbacks.
+        :return: the results of the aggregate() CallbackRunners like at start() (only of the
+        records after the checkpoint)
+        """
+        cache = ConversionCache()
+        for cb_runner, element, line in self._matches(chunk_size, on_checkpoint,
+                                                      checkpoint_interval, checkpoint_depth,
+                                                      checkpoint):
+            if cb_runner(element, line, cache) is YAXReader.STOP:
+                self._stopped = True
+        cache.clear()
+        return self._results()
+
+    async def start_async(self, stream=None, chunk_size=1 << 16, max_tasks=16):
+        """
+        Asynchronous variant of start(). The chunks are awaited from the read() method of the
+        stream (it can be also a normal stream) and the callbacks can be coroutine functions.
+        :param stream: async stream (eg. aiohttp StreamReader), the default is self.stream
+        :param max_tasks: maximum number of unfinished coroutine callbacks. When it is reached,
+        the reading waits for one of them.
+        :return: the results of the aggregate() CallbackRunners like at start()
+        """
+        stream = stream or self.stream
+        if not stream:
             raise Exception("Input stream is not initialized.")
-        elif self.stream.closed:
-            raise Exception("The input stream is closed.")
-        if Condition.LXML:
-            parser = YAXReader.etree.XMLPullParser(events=('end',))
-            prev_parent = None
-            prev_element = None
-            keep = False
-            chunk = self.stream.read(chunk_size)
-            while chunk:
-                parser.feed(chunk)
-                for action, element in parser.read_events():
-                    if not keep and prev_parent is not None:
-                        prev_parent.remove(prev_element)
-                    keep = False
-                    for cond, cb_runner in self._cnds:
-                        if cond.check(element):
-                            cb_runner(element)
-                        if not keep and cond.keep(element):
-                            keep = True
-                    prev_parent = element.getparent()
-                    prev_element = element
-                chunk = self.stream.read(chunk_size)
-        else:
-            parser = YAXReader.etree.XMLPullParser(events=('end', 'start'))
-            parents = []
-            chunk = self.stream.read(chunk_size)
-            while chunk:
-                parser.feed(chunk)
-                for action, element in parser.read_events():
-                    if action == 'start':
-                        parents.append(element)
-                    else:
-                        parents.pop()
-                        keep = False                            # Do not keep anything by default.
-                        for cond, cb_runner in self._cnds:      # For all conditions.
-                            if cond.check(element, parents):
-                                cb_runner(element)
-                            if not keep and cond.keep(element, parents):
-                                keep = True
-                        if not keep and len(parents) > 0:
-                            parents[-1].remove(element)
-                chunk = self.stream.read(chunk_size)
-        self.stream.close()
+        pending = collections.deque()
+
+        def chunks():
+            while True:
+                if not pending:
+                    yield None                      # The next chunk have to be read
+                    continue
+                chunk = pending.popleft()
+                if not chunk:
+                    return
+                yield chunk
+
+        tasks = set()
+        cache = ConversionCache()
+        try:
+            for item in self._matches(chunk_size, chunks=chunks()):
+                if item is None:
+                    chunk = stream.read(chunk_size)
+                    if inspect.isawaitable(chunk):
+                        chunk = await chunk
+                    pending.append(chunk)
+                    continue
+                cb_runner, element, line = item
+                result = cb_runner(element, line, cache)
+                if result is YAXReader.STOP:
+                    self._stopped = True
+                elif inspect.isawaitable(result):
+                    tasks.add(asyncio.ensure_future(result))
+                    if len(tasks) >= max_tasks:
+                        done, tasks = await asyncio.wait(tasks,
+                                                         return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()           # Raises the exception of the callback
+            if tasks:
+                await asyncio.gather(*tasks)
+                tasks = set()
+        finally:
+            for task in tasks:
+                task.cancel()
+            cache.clear()
+            close = getattr(stream, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+        return self._results()
+
+    def __iter__(self):
+        """
+        Pull-based alternative of start(). The matches of the CallbackRunners without callback
+        are yielded as (converted element, line number) tuples, the others call their callbacks.
+        Breaking the loop stops reading and closes the stream.
+        """
+        return self._iterate()
+
+    def iterfind(self, tag=None, attrib: dict=None, text=None, parent=None, children=None,
+                 keep_children=None, t: int=CallbackRunner.ETREE, chunk_size=None):
+        """
+        Registers a condition like find() and yields only its matches as
+        (converted element, line number) tuples. The other registered callbacks are called.
+        :param t: converter type of the yielded elements, see CallbackRunner
+        """
+        cb_runner = self.find(tag, attrib, text, parent, children, keep_children)
+        cb_runner.converts(t)
+        return self._iterate(chunk_size, only=cb_runner)
+
+    def _iterate(self, chunk_size=None, only=None):
+        cache = ConversionCache()
+        for cb_runner, element, line in self._matches(chunk_size):
+            if cb_runner is only or (only is None and not cb_runner.has_callback()):
+                yield cb_runner.convert(element, cache), line
+            elif cb_runner(element, line, cache) is YAXReader.STOP:
+                self._stopped = True
+        cache.clear()
+
+    def _chunks(self, chunk_size=None, stream=None):
+        """
+        Reads the stream. Binary streams are read into a reused buffer (except with lxml, which
+        needs bytes objects), so the parser gets them without decoding and copying.
+        If the first chunk starts with the magic bytes of gzip, bz2 or xz, the rest comes from
+        a DecompressingStream, which decompresses in a background thread.
+        :param chunk_size: size of the chunks. If it is None, the size adapts to the measured
+        throughput: after every CHUNK_WINDOW chunks it is doubled or halved, and the direction
+        turns back when the throughput of the window is lower than of the previous one.
+        :param stream: the stream to read instead of self.stream
+        """
+        stream = self.stream if stream is None else stream
+        first = True
+        adaptive = chunk_size is None
+        size = CHUNK_SIZE_START if adaptive else chunk_size
+        readinto = None
+        if not self.lxml and not isinstance(stream, io.TextIOBase):
+            readinto = getattr(stream, "readinto", None)
+        buf = view = None
+        step = 1                        # Direction of the next change of the chunk size
+        last_rate = 0.0
+        count = fed = 0
+        spent = 0.0
+        while True:
+            if readinto is not None:
+                if buf is None or len(buf) != size:
+                    view = None
+                    buf = bytearray(size)
+                    view = memoryview(buf)
+                n = readinto(buf)
+                if not n:
+                    return
+                chunk = view[:n]
+            else:
+                chunk = stream.read(size)
+                if not chunk:
+                    return
+            if first:
+                first = False
+                name = compression(chunk)
+                if name is not None:
+                    decompressed = DecompressingStream(stream, name, bytes(chunk))
+                    try:
+                        yield from self._chunks(chunk_size, decompressed)
+                    finally:
+                        decompressed.close()
+                    return
+            if adaptive:
+                t = time.perf_counter()
+                yield chunk
+                spent += time.perf_counter() - t
+                fed += len(chunk)
+                count += 1
+                if count == CHUNK_WINDOW:
+                    rate = fed / spent if spent > 0 else float("inf")
+                    if rate < last_rate:
+                        step = -step
+                    last_rate = rate
+                    if step > 0 and size >= CHUNK_SIZE_MAX or step < 0 and size <= CHUNK_SIZE_MIN:
+                        step = -step
+                    size = size * 2 if step > 0 else size // 2
+                    count = fed = 0
+                    spent = 0.0
+            else:
+                yield chunk
+            chunk = None
+
+    def _resumed(self, checkpoint: Checkpoint, chunk_size):
+        """
+        Seeks the stream to the checkpoint and prepends the rebuilt ancestors to the chunks.
+        :return: the chunks, the line and the byte offset of the fed input in the document
+        """
+        self.stream.seek(0)
+        if compression(self.stream.read(6)):
+            raise Exception("A compressed input cannot be resumed by byte offsets.")
+        self.stream.seek(checkpoint.offset)
+        m = re.search(r"""encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""",
+                      checkpoint.declaration or "")
+        header = checkpoint.header().encode(m.group(1) if m else "utf-8")
+        return itertools.chain((header, ), self._chunks(chunk_size)), \
+            checkpoint.line - 1 - header.count(b"\n"), checkpoint.offset - len(header)
+
+    def _matches(self, chunk_size=None, on_checkpoint=None, checkpoint_interval=1 << 26,
+                 checkpoint_depth=1, resume: Checkpoint=None, chunks=None):
+        """
+        The feed loop: reads the stream and yields (CallbackRunner, element, line) for each match.
+        Elements which are not needed are removed when the generator is resumed. It returns when
+        the stream ends, stop() is called or all the CallbackRunners reached their limits.
+        :param chunks: iterable of the input chunks instead of the stream. If it gives None, the
+        generator yields None, so the caller can supply the next chunk.
+        """
+        own_stream = chunks is None
+        if own_stream:
+            if not self.stream:
+                raise Exception("Input stream is not initialized.")
+            elif self.stream.closed:
+                raise Exception("The input stream is closed.")
+            if (on_checkpoint is not None or resume is not None) and \
+                    isinstance(self.stream, io.TextIOBase):
+                # The offsets of the decoded text are not the offsets in the file (eg. with CRLF
+                # newlines, a BOM or other encodings than UTF-8).
+                raise Exception("Checkpoints need a binary stream, open the file in 'rb' mode.")
+        table = DispatchTable(self._cnds, self.lxml)
+        # Shared by the conditions of the current event, the states of the Paths are kept.
+        ctx = EvalContext(PathTracker.of(self._cnds))
+        self._stopped = False
+        for aggregator in self._aggregators():
+            aggregator.reset()
+        stats = self.stats
+        if stats is not None:
+            stats.start(table, self._cnds)
+        positions = self.positions
+        track = positions or on_checkpoint is not None or resume is not None
+        try:
+            if self.lxml:
+                if on_checkpoint is not None or resume is not None:
+                    raise Exception("Checkpoints need byte offsets, which are not available " +
+                                    "with lxml.")
+                # If the tags of the possible matches are known, lxml reports only them and the
+                # other elements are dropped with the preceding siblings of the ancestors and
+                # after each chunk along the open elements (reached from the root, so the start
+                # of the root is reported too).
+                tags = table.tag_filter()
+                if chunks is None:
+                    chunks = self._chunks(chunk_size)
+                root = None
+                if tags:
+                    root_tag = None
+                    head = []                   # Fed again to the parser
+                    probe = self.etree.XMLPullParser(events=('start',))
+                    for chunk in chunks:
+                        if chunk is None:
+                            yield None
+                            continue
+                        head.append(chunk)
+                        try:
+                            probe.feed(chunk)
+                        except self.etree.XMLSyntaxError:
+                            break               # Raised by the parser
+                        root_tag = next((e.tag for _, e in probe.read_events()), None)
+                        if root_tag is not None:
+                            break
+                    probe = None
+                    chunks = itertools.chain(head, chunks)
+                    if root_tag is not None:
+                        tags = set(tags) | {root_tag}
+                    parser = self.etree.XMLPullParser(events=('start', 'end'), tag=tags)
+                else:
+                    parser = self.etree.XMLPullParser(events=('end',))
+                prev_parent = None
+                prev_element = None
+                keep = False
+                matched = False
+                for chunk in chunks:
+                    if chunk is None:
+                        yield None
+                        continue
+                    parser.feed(chunk)
+                    if stats is not None:
+                        stats.fed(len(chunk), None if prev_element is None
+                                  else prev_element.getroottree().getroot())
+                    for action, element in parser.read_events():
+                        if action == 'start':
+                            if root is None and element.getparent() is None:
+                                root = element
+                            continue
+                        if not keep and prev_parent is not None:
+                            if tags:
+                                node = prev_element
+                                while node is not None:
+                                    parent = node.getparent()
+                                    if parent is None:
+                                        break
+                                    while node.getprevious() is not None:
+                                        del parent[0]
+                                    node = parent
+                            else:                       # Comments and processing instructions
+                                node = prev_element.getprevious()
+                                while node is not None and not isinstance(node.tag, str):
+                                    prev_parent.remove(node)
+                                    node = prev_element.getprevious()
+                                if not matched:         # Nobody has a reference to it
+                                    prev_element.clear()
+                            prev_parent.remove(prev_element)
+                        if tags and len(element):       # Its children have no events
+                            del element[:]
+                        line = 0
+                        matched = False
+                        for check, cb_runner in table.handlers(element.tag):
+                            if check(element, ctx):
+                                if positions and not line:
+                                    line = line_position(element.sourceline)
+                                matched = True
+                                yield cb_runner, element, line
+                                if self._stopped or cb_runner._limit is not None and \
+                                        table.count(cb_runner):
+                                    return
+                        parent = element.getparent()
+                        keep = False
+                        if parent is not None and not tags:
+                            for keep_element in table.keepers(parent.tag):
+                                if keep_element(element, ctx):
+                                    keep = True
+                                    break
+                        prev_parent = parent
+                        prev_element = element
+                        ctx.clear()
+                    if root is not None:
+                        # Only the last child of an element can be open, its preceding siblings
+                        # are done (and reported if they had to be).
+                        node = root
+                        while len(node):
+                            if len(node) > 1:
+                                del node[:-1]
+                            node = node[-1]
+                        if prev_element is not None and prev_element.getparent() is None:
+                            prev_parent = None          # Removed by the pruning
+                    if self._stopped:                   # By an other thread
+                        return
+            else:
+                if track:
+                    parser = PositionParser(self.etree)
+                else:
+                    parser = self.etree.XMLPullParser(events=('end', 'start'))
+                parents = []
+                starts = []                 # Positions and ns declarations of the parents
+                lines = offset = 0          # Location of the fed input in the document
+                if resume is not None:
+                    chunks, lines, offset = self._resumed(resume, chunk_size)
+                elif chunks is None:
+                    chunks = self._chunks(chunk_size)
+                next_checkpoint = checkpoint_interval
+                for chunk in chunks:
+                    if chunk is None:
+                        yield None
+                        continue
+                    parser.feed(chunk)
+                    if stats is not None:
+                        stats.fed(len(chunk), parents[0] if parents else None)
+                    for action, element in parser.read_events():
+                        if action == 'start':
+                            if on_checkpoint is not None and len(parents) == checkpoint_depth \
+                                    and parser.byte + offset >= next_checkpoint:
+                                # The previous records are done, they will not be repeated.
+                                on_checkpoint(Checkpoint(
+                                    parser.byte + offset, parser.line + lines,
+                                    [(p.tag, dict(p.attrib), list(st[2]))
+                                     for p, st in zip(parents, starts)], parser.declaration))
+                                next_checkpoint = parser.byte + offset + checkpoint_interval
+                            parents.append(element)
+                            if track:
+                                starts.append((parser.line, parser.byte, parser.decls))
+                        else:
+                            parents.pop()
+                            line = 0
+                            for check, cb_runner in table.handlers(element.tag):
+                                if check(element, parents, None, ctx):
+                                    if positions and not line:
+                                        start_line, start_byte, _ = starts[-1]
+                                        end_byte = parser.end_byte(start_byte, parser.byte)
+                                        line = Position(start_line + lines, start_byte + offset,
+                                                        parser.line + lines, None if end_byte
+                                                        is None else end_byte + offset)
+                                    yield cb_runner, element, line
+                                    if self._stopped or cb_runner._limit is not None and \
+                                            table.count(cb_runner):
+                                        return
+                            if track:
+                                starts.pop()
+                            if len(parents) > 0:
+                                keep = False                    # Do not keep anything by default.
+                                for keep_element in table.keepers(parents[-1].tag):
+                                    if keep_element(element, parents, ctx):
+                                        keep = True
+                                        break
+                                if not keep:
+                                    parents[-1].remove(element)
+                            ctx.clear()
+                    if self._stopped:
+                        return
+        finally:
+            if own_stream:
+                self.stream.close()
+            try:
+                for _, cb_runner in self._cnds:     # Wait for the threaded callbacks
+                    cb_runner.join()
+            finally:
+                if stats is not None:
+                    stats.stop()
 
     def find(self, tag=None, attrib: dict=None, text=None,
              parent=None, children=None, keep_children=None) -> CallbackRunner:
@@ -207,6 +1143,15 @@ class YAXReader:
         return tup[1]
 
     def match(self, cond: Condition) -> CallbackRunner:
+        """
+        :param cond: Condition, Path or EmptyCondition (the latter is replaced by a Condition
+        which matches every element or none of them, because the conditions are compiled)
+        """
+        if isinstance(cond, EmptyCondition):
+            cond = Condition() if cond.check() else Condition().inverse()
+        elif not hasattr(cond, "compile") or not hasattr(cond, "checker"):
+            raise ConditionException("Only Condition, Path and EmptyCondition objects can be "
+                                     "matched: {!r}".format(cond))
         tup = (cond, CallbackRunner(CallbackRunner.ETREE))
         self._cnds.append(tup)
         tup[1].condition = tup[0]
@@ -1,5 +1,8 @@
 from .YAXReader import *
 from .condition import *
+from .parallel import process_files
+from .path import Path
+from .aggregate import attr, text, text_float, text_int, count
 
 __author__ = 'morta'
 
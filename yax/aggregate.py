@@ -0,0 +1,166 @@
+import re
+
+__author__ = 'Móréh, Tamás'
+
+_STEP = re.compile(r"\*|\{[^}]*\}[^\W\d][\w.\-]*|[^\W\d][\w.\-]*")
+
+
+def child_path(path: str) -> tuple:
+    """
+    :param path: relative path of child elements like "a/b" (names, {uri}names or *)
+    :return: tuple of the names, None is the * wildcard
+    """
+    steps = re.split(r"/(?![^{]*\})", path)
+    for step in steps:
+        if not _STEP.fullmatch(step):
+            raise Exception("Only the child names and * are supported in the paths: " + path)
+    return tuple(None if step == "*" else step for step in steps)
+
+
+class Extractor:
+    """
+    Gets a value from a matched element. The children needed by it (path) are kept by the parser
+    even without keep_children.
+    """
+    __slots__ = ("_get", "path")
+
+    def __init__(self, get, path: str=None):
+        self._get = get
+        self.path = child_path(path) if path else None
+
+    def __call__(self, element):
+        return self._get(element)
+
+
+def _text(element):
+    text = element.text
+    if text is not None:
+        text = text.strip()
+    return text or None
+
+
+def _child(path: str, get):
+    if not path:
+        return get
+
+    def child(element):
+        e = element.find(path)
+        return None if e is None else get(e)
+    return child
+
+
+def _number(convert, get):
+    def number(element):
+        text = get(element)
+        if text is None:
+            return None
+        try:
+            return convert(text)
+        except ValueError:
+            return None
+    return number
+
+
+def attr(name: str, path: str=None) -> Extractor:
+    """
+    :return: Extractor of an attribute of the element or of its first child at the path
+    """
+    return Extractor(_child(path, lambda e: e.get(name)), path)
+
+
+def text(path: str=None) -> Extractor:
+    """
+    :return: Extractor of the stripped text of the element or of its first child at the path
+    (None if it is empty)
+    """
+    return Extractor(_child(path, _text), path)
+
+
+def text_float(path: str=None) -> Extractor:
+    """
+    :return: Extractor of the text as a float (None if it is not a number)
+    """
+    return Extractor(_number(float, _child(path, _text)), path)
+
+
+def text_int(path: str=None) -> Extractor:
+    """
+    :return: Extractor of the text as an int (None if it is not an integer)
+    """
+    return Extractor(_number(int, _child(path, _text)), path)
+
+
+def count(path: str) -> Extractor:
+    """
+    :return: Extractor of the number of the children at the path
+    """
+    return Extractor(lambda e: len(e.findall(path)), path)
+
+
+class Accumulator:
+    __slots__ = ("count", "sum", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+
+class Aggregator:
+    """
+    Callback of CallbackRunner.aggregate(): updates the Accumulator of the group of each matched
+    element with the extracted values. The missing values are skipped.
+    """
+
+    def __init__(self, key: Extractor=None, sum: Extractor=None, min: Extractor=None,
+                 max: Extractor=None):
+        self._key = key
+        self._sum = sum
+        self._min = min
+        self._max = max
+        self._groups = {}
+
+    def extractors(self) -> list:
+        return [e for e in (self._key, self._sum, self._min, self._max) if e is not None]
+
+    def reset(self):
+        self._groups = {}
+
+    def __call__(self, element, line=0):
+        key = None if self._key is None else self._key(element)
+        acc = self._groups.get(key)
+        if acc is None:
+            self._groups[key] = acc = Accumulator()
+        acc.count += 1
+        if self._sum is not None:
+            value = self._sum(element)
+            if value is not None:
+                acc.sum += value
+        if self._min is not None:
+            value = self._min(element)
+            if value is not None and (acc.min is None or value < acc.min):
+                acc.min = value
+        if self._max is not None:
+            value = self._max(element)
+            if value is not None and (acc.max is None or value > acc.max):
+                acc.max = value
+
+    def _values(self, acc: Accumulator) -> dict:
+        values = {"count": acc.count}
+        if self._sum is not None:
+            values["sum"] = acc.sum
+        if self._min is not None:
+            values["min"] = acc.min
+        if self._max is not None:
+            values["max"] = acc.max
+        return values
+
+    def result(self) -> dict:
+        """
+        :return: {"count": ..., "sum": ..., "min": ..., "max": ...} (only the given ones), with
+        a key extractor a dict of them by the key values
+        """
+        if self._key is None:
+            return self._values(self._groups.get(None) or Accumulator())
+        return {key: self._values(acc) for key, acc in self._groups.items()}
@@ -0,0 +1,225 @@
+from .condition import Condition, EmptyCondition, EvalContext, RE
+
+__author__ = 'Móréh, Tamás'
+
+
+class ConditionCompiler:
+    """
+    Generates the source of one Python function from a Condition and its parent conditions
+    instead of the chain of the check callables. The plain string lists become set membership
+    tests, the attribute and text checks are inlined (the values are read through the shared
+    EvalContext, so the text is stripped once per event) and the cheap comparisons are evaluated
+    before the callables, the parents and the children. The children and keep_children
+    conditions are compiled on their own and called through the EvalContext (which memoizes
+    their results), the inverted sub-conditions are called through their check method.
+    """
+
+    def __init__(self, lxml: bool):
+        self.lxml = lxml
+        self.consts = {}
+        self.lines = []
+        self._n = 0
+
+    def const(self, value) -> str:
+        name = "K{}".format(len(self.consts))
+        self.consts[name] = value
+        return name
+
+    def var(self, prefix) -> str:
+        self._n += 1
+        return "{}{}".format(prefix, self._n)
+
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    def literal_test(self, spec, expr):
+        """
+        :return: the Python expression which is true if the value of expr does NOT satisfy the
+        spec, or None if the spec is not a literal one
+        """
+        if isinstance(spec, str):
+            return "{} != {}".format(expr, self.const(spec))
+        if isinstance(spec, list) and spec and all(isinstance(s, str) for s in spec):
+            return "{} not in {}".format(expr, self.const(frozenset(spec)))
+        if spec is True:
+            return "not {}".format(expr)
+        return None
+
+    def callable_test(self, spec, normalized, expr):
+        if isinstance(spec, RE):
+            return "{}.fullmatch({}) is None".format(self.const(spec), expr)
+        return "not {}({})".format(self.const(normalized), expr)
+
+    @staticmethod
+    def inlinable(cond) -> bool:
+        return isinstance(cond, Condition) and not cond._inverted and hasattr(cond, "_raw")
+
+    def checks(self, cond, var: str, fail: str, indent: int, depth):
+        """
+        Emits the statements which run fail if cond is not satisfied by the element in var.
+        :param depth: name of the variable of var's depth in the parents stack (xml module) or
+        None if the ancestors are unknown (children)
+        """
+        if isinstance(cond, EmptyCondition):
+            if not cond.check():
+                self.emit(indent, fail)
+            return
+        if not self.inlinable(cond):
+            check = self.const(cond.checker(self.lxml))
+            if self.lxml:
+                call = "{}({}, ctx)".format(check, var)
+            elif depth is None:
+                call = "{}({}, (), 0, ctx)".format(check, var)
+            else:
+                call = "{}({}, parents, {}, ctx)".format(check, var, depth)
+            self.emit(indent, "if not {}:".format(call))
+            self.emit(indent + 1, fail)
+            return
+
+        tag, attrib, text = cond._raw
+        later = []                                  # The callables are evaluated later
+        if tag is not None:
+            test = self.literal_test(tag, var + ".tag")
+            if test is None:
+                later.append(self.callable_test(tag, cond._tag, var + ".tag"))
+            else:
+                self.emit(indent, "if {}:".format(test))
+                self.emit(indent + 1, fail)
+        if attrib:
+            a = self.var("a")
+            self.emit(indent, "{} = ctx.attrib({})".format(a, var))
+            for key, spec in attrib.items():
+                expr = "{}.get({})".format(a, self.const(key))
+                test = self.literal_test(spec, expr)
+                if test is None:
+                    if spec is not None:
+                        later.append(self.callable_test(spec, cond._attrib.attrib[key], expr))
+                else:
+                    self.emit(indent, "if {}:".format(test))
+                    self.emit(indent + 1, fail)
+        if text is not None:
+            t = self.var("t")
+            self.emit(indent, "{} = ctx.text({})".format(t, var))
+            test = self.literal_test(text, t)
+            if test is None:
+                later.append(self.callable_test(text, cond._text, t))
+            else:
+                self.emit(indent, "if {}:".format(test))
+                self.emit(indent + 1, fail)
+        for test in later:
+            self.emit(indent, "if {}:".format(test))
+            self.emit(indent + 1, fail)
+
+        parent = cond._parent
+        if isinstance(parent, EmptyCondition):
+            if not parent.check():
+                self.emit(indent, fail)
+        elif not self.inlinable(parent):            # It decides about the missing parent too
+            check = self.const(parent.checker(self.lxml))
+            if self.lxml:
+                call = "{}({}.getparent(), ctx)".format(check, var)
+            elif depth is None:
+                call = "{}(None, (), 0, ctx)".format(check)
+            else:
+                call = "({0}(parents[{1} - 1], parents, {1} - 1, ctx) if {1} > 0 " \
+                       "else {0}(None, parents, 0, ctx))".format(check, depth)
+            self.emit(indent, "if not {}:".format(call))
+            self.emit(indent + 1, fail)
+        elif self.lxml:
+            p = self.var("p")
+            self.emit(indent, "{} = {}.getparent()".format(p, var))
+            self.emit(indent, "if {} is None:".format(p))
+            self.emit(indent + 1, fail)
+            self.checks(parent, p, fail, indent, None)
+        elif depth is None:
+            self.emit(indent, fail)                     # There is no way to check its parents
+        else:
+            d = self.var("d")
+            p = self.var("p")
+            self.emit(indent, "{} = {} - 1".format(d, depth))
+            self.emit(indent, "if {} < 0:".format(d))
+            self.emit(indent + 1, fail)
+            self.emit(indent, "{} = parents[{}]".format(p, d))
+            self.checks(parent, p, fail, indent, d)
+
+        if cond._children:
+            children = self.var("ch")
+            self.emit(indent, "{} = ctx.children({})".format(children, var))
+            for ch_cond in cond._children:      # Every child-condition must match to a child
+                self.any_of(ch_cond, children, indent, fail=fail)
+
+    def any_of(self, cond, candidates: str, indent: int, fail: str=None, found: str="break"):
+        """
+        Emits a loop over the candidates which runs found for the first one satisfying cond, and
+        fail if none of them satisfies it. The results are memoized by the EvalContext.
+        """
+        c = self.var("c")
+        matches = "ctx.matches_lxml" if self.lxml else "ctx.matches_xml"
+        self.emit(indent, "for {} in {}:".format(c, candidates))
+        self.emit(indent + 1, "if {}({}, {}):".format(matches, self.const(cond), c))
+        self.emit(indent + 2, found)
+        if fail is not None:
+            self.emit(indent, "else:")
+            self.emit(indent + 1, fail)
+
+    def compile_check(self, cond):
+        if self.lxml:
+            self.emit(0, "def check(element, ctx=None):")
+        else:
+            self.emit(0, "def check(element, parents, depth=None, ctx=None):")
+            self.emit(1, "if depth is None:")
+            self.emit(2, "depth = len(parents)")
+        self.emit(1, "if ctx is None:")
+        self.emit(2, "ctx = EvalContext()")
+        self.emit(1, "try:")
+        start = len(self.lines)
+        self.checks(cond, "element", "return False", 2, None if self.lxml else "depth")
+        if len(self.lines) == start:                # Nothing to test
+            self.emit(2, "pass")
+        self.emit(1, "except Exception:")
+        self.emit(2, "return False")
+        self.emit(1, "return True")
+        return self.build("check")
+
+    def compile_keep(self, cond):
+        if self.lxml:
+            self.emit(0, "def keep(element, ctx=None):")
+            self.emit(1, "parent = element.getparent()")
+            self.emit(1, "if parent is None:")
+            self.emit(2, "return True")
+        else:
+            self.emit(0, "def keep(element, parents, ctx=None):")
+            self.emit(1, "if not len(parents) > 0:")
+            self.emit(2, "return True")
+            self.emit(1, "parent = parents[-1]")
+        self.emit(1, "if ctx is None:")
+        self.emit(2, "ctx = EvalContext()")
+        tag = cond._raw[0]
+        if tag is not None:                         # Element's parent must be match
+            test = self.literal_test(tag, "parent.tag")
+            self.emit(1, "if {}:".format(test or self.callable_test(tag, cond._tag,
+                                                                    "parent.tag")))
+            self.emit(2, "return False")
+        for sub in cond._children + cond._keep:   # Keep if one of them matches
+            self.any_of(sub, "(element, )", 1, found="return True")
+        self.emit(1, "return False")
+        return self.build("keep")
+
+    def build(self, name):
+        source = "\n".join(self.lines)
+        namespace = dict(self.consts, EvalContext=EvalContext)
+        exec(compile(source, "<compiled condition>", "exec"), namespace)
+        function = namespace[name]
+        function.source = source
+        self.lines = []
+        return function
+
+
+def compile_condition(cond: Condition, lxml: bool):
+    """
+    :return: the generated check (of the not inverted condition) and keep functions
+    """
+    for sub in cond._children + cond._keep:       # They are called through the EvalContext
+        if isinstance(sub, Condition):
+            sub.compile(lxml)
+    return ConditionCompiler(lxml).compile_check(cond), ConditionCompiler(lxml).compile_keep(cond)
@@ -0,0 +1,147 @@
+import bz2
+import lzma
+import zlib
+import queue
+import threading
+
+__author__ = 'Móréh, Tamás'
+
+# Size of the compressed blocks read from the stream and the maximum size of a decompressed chunk.
+BLOCK_SIZE = 1 << 16
+CHUNK_SIZE = 1 << 18
+# Maximum number of the decompressed chunks waiting for the parser.
+QUEUE_SIZE = 8
+
+MAGIC = ((b"\x1f\x8b", "gzip"),
+         (b"BZh", "bz2"),
+         (b"\xfd7zXZ\x00", "xz"))
+
+
+def compression(head) -> str:
+    """
+    :param head: the first bytes of the input (str is never compressed)
+    :return: "gzip", "bz2", "xz" or None by the magic bytes
+    """
+    if isinstance(head, str):
+        return None
+    head = bytes(head[:6])
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _decompressor(name):
+    if name == "gzip":
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if name == "bz2":
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+def decompress(name: str, blocks):
+    """
+    Decompresses the blocks of a (possibly multi-member) gzip, bz2 or xz input.
+    :return: generator of the decompressed chunks, each at most CHUNK_SIZE bytes
+    """
+    d = None
+    for data in blocks:
+        while data:
+            if d is None or d.eof:             # The next member of a concatenated file
+                d = _decompressor(name)
+            out = d.decompress(data, CHUNK_SIZE)
+            if name == "gzip":
+                data = d.unconsumed_tail or d.unused_data
+            else:
+                while not d.eof and not d.needs_input:
+                    if out:
+                        yield out
+                    out = d.decompress(b"", CHUNK_SIZE)
+                data = d.unused_data if d.eof else b""
+            if out:
+                yield out
+    if d is not None and not d.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+class DecompressingStream:
+    """
+    Binary stream of the decompressed content of a compressed stream. A background thread reads
+    and decompresses the input into a queue of at most queue_size chunks. zlib, bz2 and lzma
+    release the GIL, so the decompression runs while the parser works on the previous chunks.
+    The errors of the thread are raised by read().
+    """
+
+    def __init__(self, stream, name: str, head: bytes=b"", queue_size: int=QUEUE_SIZE):
+        """
+        :param head: the bytes already read from the stream
+        """
+        self._queue = queue.Queue(queue_size)
+        self._chunk = b""
+        self._pos = 0                   # Read position in the current chunk
+        self._done = False
+        self._error = None
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, args=(stream, name, head), daemon=True)
+        self._thread.start()
+
+    def _run(self, stream, name, head):
+        def blocks():
+            if head:
+                yield head
+            while not self.closed:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    return
+                yield block
+
+        try:
+            for chunk in decompress(name, blocks()):
+                if not self._put(chunk):
+                    return
+        except BaseException as e:
+            self._error = e
+        self._put(None)
+
+    def _put(self, item) -> bool:
+        while not self.closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(self, size=-1) -> bytes:
+        """
+        :return: at most size bytes (at most one decompressed chunk), b"" at the end
+        """
+        data, pos = self._chunk, self._pos
+        if pos == len(data):
+            if self._done:
+                return b""
+            data = self._queue.get()
+            if data is None:
+                self._done = True
+                if self._error is not None:
+                    raise self._error
+                return b""
+            self._chunk, pos = data, 0
+        if 0 <= size < len(data) - pos:
+            self._pos = pos + size
+            return data[pos:pos + size]
+        self._pos = len(data)
+        return data[pos:] if pos else data
+
+    def close(self):
+        """
+        Stops the thread (the compressed stream is not closed).
+        """
+        self.closed = True
+        self._chunk = b""
+        self._pos = 0
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
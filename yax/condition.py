@@ -32,6 +32,77 @@ class CheckAttrib:
         return True
 
 
+class EvalContext:
+    """
+    Memo of the values needed while the conditions are checked for one parse event: the
+    stripped texts, the attributes, the child lists of the elements and the results of the
+    children and keep_children conditions (these have no parent conditions, so their result
+    depends only on the element). One object is shared by all the conditions of a parse event
+    and it has to be cleared after the event. The PathTracker of the parse (paths) is kept.
+    """
+    __slots__ = ("_texts", "_attribs", "_children", "_results", "paths")
+
+    def __init__(self, paths=None):
+        self._texts = {}
+        self._attribs = {}
+        self._children = {}
+        self._results = {}
+        self.paths = paths
+
+    def clear(self):
+        self._texts.clear()
+        self._attribs.clear()
+        self._children.clear()
+        self._results.clear()
+
+    def text(self, element):
+        try:
+            return self._texts[element]
+        except KeyError:
+            text = element.text
+            if text is not None:
+                text = text.strip()
+            self._texts[element] = text
+            return text
+
+    def attrib(self, element):
+        try:
+            return self._attribs[element]
+        except KeyError:
+            self._attribs[element] = attrib = element.attrib
+            return attrib
+
+    def children(self, element) -> list:
+        try:
+            return self._children[element]
+        except KeyError:
+            self._children[element] = children = list(element)
+            return children
+
+    def matches_xml(self, cond, element) -> bool:
+        key = (cond, element)
+        try:
+            return self._results[key]
+        except KeyError:
+            self._results[key] = result = cond.checker(False)(element, (), 0, self)
+            return result
+
+    def matches_lxml(self, cond, element) -> bool:
+        key = (cond, element)
+        try:
+            return self._results[key]
+        except KeyError:
+            self._results[key] = result = cond.checker(True)(element, self)
+            return result
+
+
+def lxml_element(element) -> bool:
+    """
+    :return: True if the element is an lxml element (not an xml.etree one)
+    """
+    return hasattr(element, "getparent")
+
+
 class EmptyCondition:
     def __init__(self, b: bool):
         self._return_default = b
@@ -39,16 +110,20 @@ class EmptyCondition:
     def check(self, *_):
         return self._return_default
 
+    def checker(self, lxml: bool):
+        return self.check
 
-class Condition:
-
-    LXML = False
 
+class Condition:
     """
     Condition class for filtering the XML parse events.
     If the condition satisfies the callback function will be called.
     """
 
+    # Deprecated: the back-end of the last created YAXReader. The conditions do not use it, the
+    # back-end belongs to the reader.
+    LXML = False
+
     @staticmethod
     def normalize_condition(cnd, allow_parents=True, allow_children=True, none_answer=True,
                             allow_none=True):
@@ -136,6 +211,20 @@ class Condition:
             raise ConditionException("Invalid parameter as tag/text name filter! {}".
                                      format(type(tag)))
 
+    @staticmethod
+    def literal_tags(tag):
+        """
+        Collects the plain tag names of a tag-condition definition.
+        :param tag: Condition for tag name, like at normalize_tag.
+        :return: a frozenset of the tag names if the condition is a str or a list of str, None
+        if it can be satisfied by other names too (regexp, callable, None).
+        """
+        if isinstance(tag, str):
+            return frozenset((tag, ))
+        if isinstance(tag, list) and tag and all(isinstance(t, str) for t in tag):
+            return frozenset(tag)
+        return None
+
     @staticmethod
     def normalize_attrib(attrib):
         """
@@ -156,19 +245,12 @@ class Condition:
                  parent=None, children=None, keep_children=None):
 
         self._inverted = False  # self doesn't matches if would be match
-
-        # The LXML way has different methods:
-        if Condition.LXML:
-            self.check = self._check_lxml
-            self.keep = self._keep_lxml
-            self._check_children = self._check_children_lxml
-        else:
-            self.check = self._check_xml
-            self.keep = self._keep_xml
-            self._check_children = self._check_children_xml
+        self._raw = (tag, attrib, text)     # The definitions for the compiler
+        self._compiled = {}                 # lxml in use -> (check, keep)
 
         # condition attributes (check callables will be created):
         self._tag = Condition.normalize_tag(tag)
+        self._tag_names = Condition.literal_tags(tag)   # Used for the dispatch table
         self._attrib = Condition.normalize_attrib(attrib)
         self._text = Condition.normalize_tag(text)
         self._parent = Condition.normalize_condition(parent, allow_children=False)
@@ -181,109 +263,163 @@ class Condition:
         :return: The negated condition itself.
         """
         self._inverted = not self._inverted
+        return self
+
+    def check(self, element, *args) -> bool:
+        """
+        Checks the element with the method of its back-end.
+        The arguments are (element, ctx=None) with lxml, (element, parents=(), depth=None,
+        ctx=None) with the xml module, see _check_xml().
+        """
+        return self.checker(lxml_element(element))(element, *args)
+
+    def keep(self, element, *args) -> bool:
+        """
+        Tells whether the element has to be kept in its parent, the arguments are
+        (element, ctx=None) with lxml and (element, parents, ctx=None) with the xml module.
+        """
+        return self.keeper(lxml_element(element))(element, *args)
+
+    def checker(self, lxml: bool):
+        """
+        :return: the check function of the back-end (the compiled one if it is compiled)
+        """
         if self._inverted:
-            self.check = self._inverted_check_lxml if Condition.LXML \
-                else self._inverted_check_xml
-        else:
-            self.check = self._check_lxml if Condition.LXML \
-                else self._check_xml
+            return self._inverted_check_lxml if lxml else self._inverted_check_xml
+        compiled = self._compiled.get(lxml)
+        if compiled is not None:
+            return compiled[0]
+        return self._check_lxml if lxml else self._check_xml
+
+    def keeper(self, lxml: bool):
+        """
+        :return: the keep function of the back-end (the compiled one if it is compiled)
+        """
+        compiled = self._compiled.get(lxml)
+        if compiled is not None:
+            return compiled[1]
+        return self._keep_lxml if lxml else self._keep_xml
+
+    def compile(self, lxml: bool=None):
+        """
+        Generates the check and keep functions of a back-end (both if lxml is None) from the whole
+        condition tree. The results are the same, only faster. An inverted condition is checked
+        by its method.
+        :return: The condition itself.
+        """
+        from .compiler import compile_condition
+        for backend in ((True, False) if lxml is None else (lxml, )):
+            if backend not in self._compiled:
+                self._compiled[backend] = compile_condition(self, backend)
         return self
 
-    def _check_children_lxml(self, element):
-        children = list(element)  # Every child-condition must be matching to a
+    def _check_children_lxml(self, element, ctx):
+        children = ctx.children(element)  # Every child-condition must be matching to a
         for ch_cond in self._children:  # child
             found = False
             for child in children:
-                if ch_cond.check(child):
+                if ctx.matches_lxml(ch_cond, child):
                     found = True
                     break
             if not found:
                 return False
         return True
 
-    def _check_children_xml(self, element):
-        children = list(element)  # Every child-condition must be matching to a
+    def _check_children_xml(self, element, ctx):
+        children = ctx.children(element)  # Every child-condition must be matching to a
         for ch_cond in self._children:  # child
             found = False
             for child in children:
-                if ch_cond.check(child, []):  # There is no way to check children's parents!
+                if ctx.matches_xml(ch_cond, child):  # No way to check children's parents!
                     found = True
                     break
             if not found:
                 return False
         return True
 
-    def _check_lxml(self, element) -> bool:
+    def _check_lxml(self, element, ctx=None) -> bool:
+        if ctx is None:
+            ctx = EvalContext()
         try:
             # If any part of condition is false, return with false.
             if not self._tag(element.tag):                          # Checking tagname
                 return False
-            if not self._attrib(element.attrib):                    # Checking attribs
+            if not self._attrib(ctx.attrib(element)):               # Checking attribs
                 return False
-            if element.text is None:                                # Checking text
-                if not self._text(None):
-                    return False
-            else:
-                if not self._text(element.text.strip()):
-                    return False
-            if not self._parent.check(element.getparent()):     # Checking parent
+            if not self._text(ctx.text(element)):                   # Checking text
+                return False
+            check = self._parent.checker(True)
+            if not check(element.getparent(), ctx):                 # Checking parent
                 return False
-            if not self._check_children(element):                   # Checking children
+            if not self._check_children_lxml(element, ctx):         # Checking children
                 return False
         except:
             return False
         return True
 
-    def _check_xml(self, element, parents) -> bool:
+    def _check_xml(self, element, parents=(), depth=None, ctx=None) -> bool:
+        """
+        :param parents: the stack of the ancestors, the direct parent is parents[depth - 1]
+        :param depth: number of the valid ancestors in parents, the default is all of them
+        :param ctx: EvalContext shared by the conditions checked for the same parse event
+        """
+        if depth is None:
+            depth = len(parents)
+        if ctx is None:
+            ctx = EvalContext()
         try:
             # If any part of condition is false, return with false.
             if not self._tag(element.tag):                          # Checking tagname
                 return False
-            if not self._attrib(element.attrib):                    # Checking attribs
+            if not self._attrib(ctx.attrib(element)):               # Checking attribs
                 return False
-            if element.text is None:                                # Checking text
-                if not self._text(None):
-                    return False
-            else:
-                if not self._text(element.text.strip()):
-                    return False
-            if not self._parent.check(parents[-1] if len(parents) > 0 else None, parents[:-1]):
+            if not self._text(ctx.text(element)):                   # Checking text
+                return False
+            check = self._parent.checker(False)
+            if depth > 0:                                           # Checking parent
+                if not check(parents[depth - 1], parents, depth - 1, ctx):
                     return False
-            if not self._check_children(element):                   # Checking children
+            elif not check(None, parents, 0, ctx):
+                return False
+            if not self._check_children_xml(element, ctx):          # Checking children
                 return False
         except:
             return False
         return True
 
-    def _inverted_check_lxml(self, element) -> bool:
-        return not self._check_lxml(element)
+    def _inverted_check_lxml(self, element, ctx=None) -> bool:
+        return not self._check_lxml(element, ctx)
 
-    def _inverted_check_xml(self, element, parents) -> bool:
-        return not self._check_xml(element, parents)
+    def _inverted_check_xml(self, element, parents=(), depth=None, ctx=None) -> bool:
+        return not self._check_xml(element, parents, depth, ctx)
 
-    def _keep_lxml(self, element) -> bool:
+    def _keep_lxml(self, element, ctx=None) -> bool:
         parent = element.getparent()
         if parent is None:
             return True
         if not self._tag(parent.tag):     # Element's parent must be match
             return False
+        if ctx is None:
+            ctx = EvalContext()
         for ch_cond in self._children:                  # Keep if it is in the children conditions
-            if ch_cond.check(element):
+            if ctx.matches_lxml(ch_cond, element):
                 return True
         for keep_cond in self._keep:                    # Keep if it is in the keep conditions
-            if keep_cond.check(element):
+            if ctx.matches_lxml(keep_cond, element):
                 return True
         return False
 
-    def _keep_xml(self, element, parents) -> bool:
+    def _keep_xml(self, element, parents, ctx=None) -> bool:
         if not len(parents) > 0:
             return True
         if not self._tag(parents[-1].tag):     # Element's parent must be match
             return False
+        if ctx is None:
+            ctx = EvalContext()
         for ch_cond in self._children:                  # Keep if it is in the children conditions
-            if ch_cond.check(element, parents):
+            if ctx.matches_xml(ch_cond, element):
                 return True
         for keep_cond in self._keep:                    # Keep if it is in the keep conditions
-            if keep_cond.check(element, parents):
+            if ctx.matches_xml(keep_cond, element):
                 return True
         return False
@@ -0,0 +1,78 @@
+import os
+import mmap
+
+__author__ = 'Móréh, Tamás'
+
+
+class MappedStream:
+    """
+    Binary stream of a memory-mapped file. read() returns memoryview slices of the mapping, so
+    the chunks are not copied (as_bytes=True returns bytes, eg. for lxml).
+    Closing stops the reading but the mapping is kept for slice() until release() or the garbage
+    collection.
+    """
+
+    def __init__(self, path, as_bytes=False):
+        self.name = path
+        self._as_bytes = as_bytes
+        self._pos = 0
+        self.closed = False
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+        if self._map is not None and hasattr(self._map, "madvise"):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("read from closed MappedStream")
+        start = self._pos
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._pos = end
+        if self._as_bytes:
+            return self._map[start:end] if self._map is not None else b""
+        return self._view[start:end]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def slice(self, start: int, end: int) -> bytes:
+        """
+        :return: the bytes of the file between the offsets (eg. of a Position)
+        """
+        if self._view is None:
+            raise ValueError("The mapping is released.")
+        return self._view[start:end].tobytes()
+
+    def close(self):
+        self.closed = True
+
+    def release(self):
+        """
+        Unmaps the file. If a chunk is still referenced, it happens at the garbage collection.
+        """
+        self.closed = True
+        view, self._view = self._view, None
+        if view is not None:
+            try:
+                view.release()
+                if self._map is not None:
+                    self._map.close()
+            except BufferError:
+                pass
+        self._map = None
@@ -0,0 +1,265 @@
+import os
+import re
+import mmap
+import itertools
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .position import Position, start_tags
+from .compressed import compression
+from .YAXReader import ConversionCache, DispatchTable, CallbackRunner
+from .aggregate import Aggregator
+
+__author__ = 'Móréh, Tamás'
+
+# Approximate size of the byte ranges parsed by one task.
+RANGE_SIZE = 1 << 25
+
+# Readers of the running parallel parses. The forked workers inherit them, so the conditions
+# (which usually contain lambdas) need not be pickled.
+_READERS = {}
+_tokens = itertools.count()
+
+_DECLARATION = re.compile(rb"^\s*<\?xml[^>]*\?>")
+_ENCODING = re.compile(rb"""encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+
+class RangeStream:
+    """
+    Binary stream of a byte range of a file preceded by a header.
+    """
+
+    def __init__(self, path, header: bytes, start: int, end: int):
+        self._header = header
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._left = end - start
+        self.closed = False
+
+    def read(self, size=-1):
+        if self._header:
+            chunk, self._header = self._header, b""
+            return chunk
+        if size < 0 or size > self._left:
+            size = self._left
+        chunk = self._file.read(size)
+        self._left -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+        self.closed = True
+
+
+def record_start(data, record_tag: str, pos: int, end: int=None) -> int:
+    """
+    Finds the first start tag of a record at or after pos.
+    :param data: bytes-like object of the whole file (eg. mmap)
+    :param record_tag: the tag name of the records as it is written in the file
+    :return: offset of the '<' of the start tag or -1
+    """
+    pattern = re.compile(b"<" + re.escape(record_tag.encode()) + rb"[\s/>]")
+    m = pattern.search(data, pos, len(data) if end is None else end)
+    return m.start() if m else -1
+
+
+def split_ranges(data, record_tag: str, parts: int) -> list:
+    """
+    Splits the file into about equal byte ranges, each range (except the first one) starts with
+    a record start tag.
+    :return: list of (start, end) tuples, the first range starts at 0, the last ends at EOF
+    """
+    size = len(data)
+    bounds = [0]
+    for k in range(1, parts):
+        pos = record_start(data, record_tag, max(size * k // parts, bounds[-1] + 1))
+        if pos < 0:
+            break
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def ancestor_header(data, first: int) -> bytes:
+    """
+    Builds the prolog which opens the ancestors of the records for the ranges after the first.
+    The XML declaration is kept, the start tags are rebuilt from the prefix before the first
+    record with the same namespace prefixes, so the original end tags close them.
+    :param first: offset of the first record
+    """
+    prefix = bytes(data[:first])
+    parser = ElementTree.XMLPullParser(events=('start', 'end', 'start-ns'))
+    parser.feed(prefix)
+    stack = []              # [(tag, attrib, [(ns prefix, uri), ...]), ...]
+    declared = []
+    for action, item in parser.read_events():
+        if action == 'start-ns':
+            declared.append(item)
+        elif action == 'start':
+            stack.append((item.tag, item.attrib, declared))
+            declared = []
+        else:
+            stack.pop()
+    m = _DECLARATION.match(prefix)
+    header = m.group(0).strip() if m else b""
+    enc = _ENCODING.search(header)
+    encoding = enc.group(1).decode() if enc else "utf-8"
+    return header + start_tags(stack).encode(encoding)
+
+
+def _parse_range(task):
+    token, path, header, start, end, (lines, offset), chunk_size = task
+    reader = _READERS[token]
+    indices = {id(cb_runner): i for i, (_, cb_runner) in enumerate(reader._cnds)}
+    results = []
+    cache = ConversionCache()
+    reader.stream = RangeStream(path, header, start, end)
+    for cb_runner, element, line in reader._matches(chunk_size):
+        if cb_runner.has_callback():
+            if isinstance(line, Position) and start > 0:
+                line = line.shifted(lines, offset)
+            results.append((indices[id(cb_runner)], cb_runner.convert(element, cache), line))
+    return results
+
+
+def start_parallel(reader, record_tag: str, workers: int, ordered=True, chunk_size=None):
+    """
+    Parses the file of the reader's stream in byte ranges in worker processes and calls the
+    callbacks in this process with the converted matches.
+    """
+    try:
+        path = reader.stream.name
+        if not isinstance(path, (str, bytes)) or not os.path.isfile(path):
+            raise AttributeError
+    except AttributeError:
+        raise Exception("Parallel parsing needs a stream of a regular file.")
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise Exception("Parallel parsing needs the fork start method.")
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise Exception("The input file is empty.")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if compression(data[:6]):
+                raise Exception("Parallel parsing needs an uncompressed file.")
+            first = record_start(data, record_tag, 0)
+            if first < 0:
+                ranges = [(0, len(data))]
+                header = b""
+            else:
+                ranges = split_ranges(data, record_tag, max(workers, len(data) // RANGE_SIZE))
+                header = ancestor_header(data, first)
+            shifts = [(0, 0)] * len(ranges)
+            if reader.positions:                # Line and byte offsets of the ranges
+                lines = 0
+                shifts = []
+                for start, end in ranges:
+                    if start == 0:
+                        shifts.append((0, 0))
+                    else:
+                        shifts.append((lines - header.count(b"\n"), start - len(header)))
+                    for i in range(start, end, RANGE_SIZE):
+                        lines += data[i:min(i + RANGE_SIZE, end)].count(b"\n")
+    token = next(_tokens)
+    _READERS[token] = reader
+    tasks = [(token, path, b"" if start == 0 else header, start, end, shift, chunk_size)
+             for (start, end), shift in zip(ranges, shifts)]
+    cnds = reader._cnds
+    # The limits are counted here, the workers parse their ranges to the end.
+    remaining = {i: cb_runner._limit for i, (_, cb_runner) in enumerate(cnds)
+                 if cb_runner._limit is not None}
+    reader._stopped = False
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as ex:
+            if ordered:
+                results = ex.map(_parse_range, tasks)
+            else:
+                results = (f.result() for f in as_completed(
+                    [ex.submit(_parse_range, t) for t in tasks]))
+            for result in results:
+                for index, converted, line in result:
+                    left = remaining.get(index)
+                    if left == 0:
+                        continue
+                    if cnds[index][1].call_converted(converted, line) is reader.STOP:
+                        reader.stop()
+                    if left is not None:
+                        remaining[index] = left - 1
+                    if reader._stopped or len(remaining) == len(cnds) and \
+                            not any(remaining.values()):
+                        break
+                else:
+                    continue
+                ex.shutdown(wait=False, cancel_futures=True)
+                break
+    finally:
+        del _READERS[token]
+        reader.stream.close()
+        for _, cb_runner in cnds:
+            cb_runner.join()
+
+
+def _parse_file(task):
+    token, index, chunk_size = task
+    reader, paths = _READERS[token]
+    indices = {id(cb_runner): i for i, (_, cb_runner) in enumerate(reader._cnds)}
+    results = []
+    cache = ConversionCache()
+    reader.stream = open(paths[index], "rb")
+    for cb_runner, element, line in reader._matches(chunk_size):
+        results.append((indices[id(cb_runner)], cb_runner.convert(element, cache), line))
+    return results
+
+
+def process_files(paths, reader_factory, workers: int=None, ordered=True, chunk_size=None):
+    """
+    Parses many files with the same conditions in worker processes. The reader is created and
+    its conditions are compiled only once, the forked workers inherit them. The biggest files
+    are started first, so a large file at the end of the list does not delay the finish.
+    :param reader_factory: callable without arguments which returns a YAXReader with the
+    registered conditions (and without stream). Its callbacks are not called, the converters
+    of the CallbackRunners are used.
+    :param workers: number of processes (default: number of CPUs), 1 parses in this process
+    :param ordered: the matches are yielded in the order of the paths, otherwise as the files
+    are done
+    :return: generator of (path, index of the CallbackRunner, converted element, line number)
+    tuples, the index is the registration order of the condition in the reader
+    """
+    paths = list(paths)
+    reader = reader_factory()
+    if any(isinstance(cb_runner._callback, Aggregator) for _, cb_runner in reader._cnds):
+        raise Exception("The aggregate() CallbackRunners are not supported by process_files(), "
+                        "their callbacks are not called.")
+    if reader.lxml and any(cb_runner._type == CallbackRunner.ETREE
+                           for _, cb_runner in reader._cnds):
+        raise Exception("The lxml elements cannot be passed between processes, " +
+                        "use a STRING, DICT or JSON_DICT converter.")
+    DispatchTable(reader._cnds, reader.lxml)            # Compiles the conditions
+    workers = workers or os.cpu_count() or 1
+    token = next(_tokens)
+    _READERS[token] = (reader, paths)
+    try:
+        if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+            for i, path in enumerate(paths):
+                for index, converted, line in _parse_file((token, i, chunk_size)):
+                    yield path, index, converted, line
+            return
+        biggest = sorted(range(len(paths)), key=lambda i: os.path.getsize(paths[i]), reverse=True)
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as ex:
+            futures = {}
+            for i in biggest:
+                futures[i] = ex.submit(_parse_file, (token, i, chunk_size))
+            try:
+                if ordered:
+                    done = (i for i in range(len(paths)))
+                else:
+                    indices = {future: i for i, future in futures.items()}
+                    done = (indices[future] for future in as_completed(futures.values()))
+                for i in done:
+                    for index, converted, line in futures.pop(i).result():
+                        yield paths[i], index, converted, line
+            finally:
+                for future in futures.values():
+                    future.cancel()
+    finally:
+        del _READERS[token]
@@ -0,0 +1,357 @@
+import re
+from .condition import Condition, ConditionException, EvalContext
+
+__author__ = 'Móréh, Tamás'
+
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+_NAME = re.compile(r"\*|\{[^}]*\}[^\W\d][\w.\-]*|[^\W\d][\w.\-]*(?::[^\W\d][\w.\-]*)?")
+_TERM = re.compile(r"""\s*(?:@(?P<attr>\{[^}]*\}[^\W\d][\w.\-]*|[^\W\d][\w.\-]*(?::[\w.\-]+)?)"""
+                   r"""|(?P<text>text\(\)))\s*(?:(?P<op>!?=)\s*(?P<value>'[^']*'|"[^"]*"))?\s*$""")
+
+
+class Step:
+    """
+    A location step of a Path: the axis, the name test and the predicates.
+    """
+    __slots__ = ("descendant", "name", "attrib", "text")
+
+    def __init__(self, descendant: bool, name, attrib: list, text: list):
+        self.descendant = descendant        # // axis, otherwise child
+        self.name = name                    # None is the * wildcard
+        self.attrib = Step._all(attrib) if attrib else None
+        self.text = Step._all(text) if text else None
+
+    @staticmethod
+    def _all(tests: list):
+        if len(tests) == 1:
+            return tests[0]
+        return lambda value: all(test(value) for test in tests)
+
+
+def _test(get, op, value):
+    if op is None:
+        return lambda d: get(d) is not None
+    if op == "=":
+        return lambda d: get(d) == value
+
+    def differs(d):
+        v = get(d)                      # Like in XPath, a missing value is not different
+        return v is not None and v != value
+    return differs
+
+
+class Path:
+    """
+    Streaming path query: a subset of XPath compiled into a state machine.
+    Supported: absolute (/a/b) and descendant (//a, a//b) location paths, relative paths (they
+    match anywhere, like //), * and namespaced names ({uri}name or prefix:name with the
+    namespaces dict), attribute predicates ([@a], [@a='v'], [@a!='v']) and text predicates on the
+    last step ([text()], [text()='v'], the text is stripped like at the Conditions). The terms of
+    a predicate can be joined by "and".
+    The states of the ancestors are computed once per ancestor (while it is open) and they are
+    shared by all the Paths of a parse, so checking an element costs the same for any depth and
+    any number of Paths.
+    """
+
+    def __init__(self, expression: str, namespaces: dict=None, keep_children=None):
+        """
+        :param keep_children: condition for the children of the matched elements which have to
+        be kept (like at the Condition)
+        """
+        self.expression = expression
+        self._namespaces = dict(namespaces or {})
+        self._steps = self._parse(expression)
+        self._length = len(self._steps)
+        self._accept = (self, self._length)
+        self._inverted = False
+        self._raw = (expression, None, None)        # For the statistics
+        last = self._steps[-1].name
+        self._tag_names = None if last is None else frozenset((last, ))
+        self._tag = (lambda tag: True) if last is None else (lambda tag: tag == last)
+        self._children = []
+        self._keep = Condition.normalize_children(keep_children)
+
+    def __repr__(self):
+        return "Path({!r})".format(self.expression)
+
+    def _qname(self, name: str) -> str:
+        if name[:1] == "{" or ":" not in name:
+            return name
+        prefix, local = name.split(":", 1)
+        if prefix == "xml":
+            return "{" + _XML_NAMESPACE + "}" + local
+        try:
+            return "{" + self._namespaces[prefix] + "}" + local
+        except KeyError:
+            raise ConditionException("Unknown namespace prefix in the path: {}".format(prefix))
+
+    @staticmethod
+    def _split(expression: str) -> list:
+        """
+        :return: list of (axis, step) strings
+        """
+        if not expression.startswith("/"):
+            expression = "//" + expression
+        steps = []
+        i, n = 0, len(expression)
+        while i < n:
+            axis = "//" if expression.startswith("//", i) else "/"
+            i += len(axis)
+            start = i
+            depth = 0
+            quote = None
+            while i < n:
+                c = expression[i]
+                if quote is not None:
+                    if c == quote:
+                        quote = None
+                elif c in "'\"" and depth:
+                    quote = c
+                elif c == "{":
+                    i = expression.find("}", i)
+                    if i < 0:
+                        raise ConditionException("Missing } in the path: " + expression)
+                elif c == "[":
+                    depth += 1
+                elif c == "]":
+                    depth -= 1
+                elif c == "/" and not depth:
+                    break
+                i += 1
+            if quote is not None or depth:
+                raise ConditionException("Unclosed predicate in the path: " + expression)
+            steps.append((axis, expression[start:i].strip()))
+        return steps
+
+    @staticmethod
+    def _predicates(step: str) -> tuple:
+        """
+        :return: the name and the list of the predicate expressions of a step
+        """
+        m = _NAME.match(step)
+        if m is None:
+            raise ConditionException("Unsupported step in the path: {!r}".format(step))
+        name, rest = m.group(0), step[m.end():].strip()
+        predicates = []
+        while rest:
+            if rest[0] != "[":
+                raise ConditionException("Unsupported step in the path: {!r}".format(step))
+            quote = None
+            for i, c in enumerate(rest):
+                if quote is not None:
+                    if c == quote:
+                        quote = None
+                elif c in "'\"":
+                    quote = c
+                elif c == "]":
+                    break
+            predicates.append(rest[1:i])
+            rest = rest[i + 1:].strip()
+        return name, predicates
+
+    def _parse(self, expression: str) -> list:
+        steps = []
+        parts = self._split(expression)
+        for k, (axis, step) in enumerate(parts):
+            name, predicates = self._predicates(step)
+            attrib = []
+            text = []
+            for predicate in predicates:
+                for term in re.split(r"\s+and\s+(?=(?:[^'\"]|'[^']*'|\"[^\"]*\")*$)", predicate):
+                    m = _TERM.match(term)
+                    if m is None:
+                        raise ConditionException("Unsupported predicate in the path: [{}]"
+                                                 .format(predicate))
+                    value = m.group("value")
+                    if value is not None:
+                        value = value[1:-1]
+                    if m.group("attr"):
+                        key = self._qname(m.group("attr"))
+                        attrib.append(_test(lambda d, key=key: d.get(key), m.group("op"), value))
+                    elif k < len(parts) - 1:
+                        raise ConditionException("The text() predicates are supported only in "
+                                                 "the last step: " + expression)
+                    else:
+                        text.append(_test(lambda t: t or None, m.group("op"), value))
+            steps.append(Step(axis == "//", None if name == "*" else self._qname(name),
+                              attrib, text))
+        return steps
+
+    def inverse(self):
+        self._inverted = not self._inverted
+        return self
+
+    def compile(self, lxml: bool=None):
+        return self
+
+    def checker(self, lxml: bool):
+        return self._check_lxml if lxml else self._check_xml
+
+    def keeper(self, lxml: bool):
+        return self._keep_lxml if lxml else self._keep_xml
+
+    def check(self, element, *args) -> bool:
+        return self.checker(hasattr(element, "getparent"))(element, *args)
+
+    def _tracker(self, ctx):
+        tracker = ctx.paths
+        if tracker is None or self not in tracker.paths:
+            tracker = PathTracker([self])           # Not registered in the reader
+        return tracker
+
+    def _accepts(self, states, element, ctx) -> bool:
+        if self._accept not in states:
+            return self._inverted
+        test = self._steps[-1].text
+        if test is not None and not test(ctx.text(element)):
+            return self._inverted
+        return not self._inverted
+
+    def _check_lxml(self, element, ctx=None) -> bool:
+        if ctx is None:
+            ctx = EvalContext()
+        return self._accepts(self._tracker(ctx).states_lxml(element), element, ctx)
+
+    def _check_xml(self, element, parents=(), depth=None, ctx=None) -> bool:
+        if depth is None:
+            depth = len(parents)
+        if ctx is None:
+            ctx = EvalContext()
+        return self._accepts(self._tracker(ctx).states_xml(element, parents, depth), element, ctx)
+
+    def _keep_parent(self, parent, element, ctx, matches) -> bool:
+        name = self._steps[-1].name
+        if name is not None and parent.tag != name:
+            return False
+        for keep_cond in self._keep:
+            if matches(keep_cond, element):
+                return True
+        return False
+
+    def _keep_lxml(self, element, ctx=None) -> bool:
+        parent = element.getparent()
+        if parent is None:
+            return True
+        if ctx is None:
+            ctx = EvalContext()
+        return self._keep_parent(parent, element, ctx, ctx.matches_lxml)
+
+    def _keep_xml(self, element, parents, ctx=None) -> bool:
+        if not len(parents) > 0:
+            return True
+        if ctx is None:
+            ctx = EvalContext()
+        return self._keep_parent(parents[-1], element, ctx, ctx.matches_xml)
+
+
+class PathTracker:
+    """
+    The state machine of the Paths of a parse. A state is a (Path, number of the matched steps)
+    tuple, the states of an element are computed from the states of its parent. The ancestors
+    of the current element are kept on a stack with their states, so each of them is computed
+    once. The transitions without attribute predicates are memoized by (states, tag).
+    """
+
+    def __init__(self, paths: list):
+        self.paths = frozenset(paths)
+        self._root = frozenset((path, 0) for path in paths)
+        self._memo = {}
+        self._stack = []                # [(ancestor, states), ...] from the root
+        self._index = {}                # id(ancestor) -> position in the stack (lxml)
+        self._last = None               # The last element and its states
+        self._last_states = None
+
+    @staticmethod
+    def of(cnds: list):
+        """
+        :return: the PathTracker of the Paths of the (condition, CallbackRunner) list or None
+        """
+        paths = [cond for cond, _ in cnds if isinstance(cond, Path)]
+        return PathTracker(paths) if paths else None
+
+    def step(self, states: frozenset, element) -> frozenset:
+        """
+        :return: the states of the element whose parent has the given states
+        """
+        key = (states, element.tag)
+        try:
+            base, tests = self._memo[key]
+        except KeyError:
+            base = set()
+            tests = []
+            for path, i in states:
+                if i == path._length:
+                    continue
+                step = path._steps[i]
+                if step.descendant:
+                    base.add((path, i))
+                if step.name is None or step.name == element.tag:
+                    if step.attrib is None:
+                        base.add((path, i + 1))
+                    else:
+                        tests.append((step.attrib, (path, i + 1)))
+            base = frozenset(base)
+            self._memo[key] = base, tests
+        if not tests:
+            return base
+        attrib = element.attrib
+        extra = [state for test, state in tests if test(attrib)]
+        return base.union(extra) if extra else base
+
+    def states_xml(self, element, parents, depth: int) -> frozenset:
+        """
+        :param parents: the stack of the ancestors, the direct parent is parents[depth - 1]
+        """
+        if element is self._last:
+            return self._last_states
+        stack = self._stack
+        if len(stack) > depth and stack[depth][0] is element:      # A closed ancestor
+            states = stack[depth][1]
+            del stack[depth:]
+            return states
+        k = min(len(stack), depth)
+        while k > 0 and stack[k - 1][0] is not parents[k - 1]:
+            k -= 1
+        del stack[k:]
+        states = stack[-1][1] if stack else self._root
+        for parent in parents[k:depth]:
+            states = self.step(states, parent)
+            stack.append((parent, states))
+        self._last = element
+        self._last_states = states = self.step(states, element)
+        return states
+
+    def states_lxml(self, element) -> frozenset:
+        if element is self._last:
+            return self._last_states
+        stack = self._stack
+        index = self._index
+        pos = index.get(id(element))
+        if pos is not None and pos < len(stack) and stack[pos][0] is element:
+            states = stack[pos][1]
+            for ancestor, _ in stack[pos:]:
+                del index[id(ancestor)]
+            del stack[pos:]
+            return states
+        chain = []
+        node = element.getparent()
+        k = 0
+        while node is not None:
+            pos = index.get(id(node))
+            if pos is not None and pos < len(stack) and stack[pos][0] is node:
+                k = pos + 1
+                break
+            chain.append(node)
+            node = node.getparent()
+        for ancestor, _ in stack[k:]:
+            del index[id(ancestor)]
+        del stack[k:]
+        states = stack[-1][1] if stack else self._root
+        for ancestor in reversed(chain):
+            states = self.step(states, ancestor)
+            index[id(ancestor)] = len(stack)
+            stack.append((ancestor, states))
+        self._last = element
+        self._last_states = states = self.step(states, element)
+        return states
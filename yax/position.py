@@ -0,0 +1,231 @@
+import json
+import pyexpat
+import functools
+from xml.sax.saxutils import quoteattr
+
+__author__ = 'Móréh, Tamás'
+
+
+class Position(int):
+    """
+    Location of a matched subtree. Its int value is the line number of the start tag, so it can
+    be used as the line number argument of the callbacks.
+    The byte offsets are counted in the fed input (in the UTF-8 encoded text when the stream is
+    a text stream), the end offset points after the end tag. The unknown values are None.
+    """
+    start_byte = end_line = end_byte = None
+
+    def __new__(cls, start_line: int, start_byte: int=None, end_line: int=None,
+                end_byte: int=None):
+        self = int.__new__(cls, start_line)
+        self.start_byte = start_byte
+        self.end_line = end_line
+        self.end_byte = end_byte
+        return self
+
+    @property
+    def start_line(self) -> int:
+        return int(self)
+
+    def shifted(self, lines: int, offset: int):
+        """
+        :return: the same position in a larger input where this one starts at lines, offset
+        """
+        return Position(int(self) + lines,
+                        None if self.start_byte is None else self.start_byte + offset,
+                        None if self.end_line is None else self.end_line + lines,
+                        None if self.end_byte is None else self.end_byte + offset)
+
+    def __reduce__(self):
+        return Position, (int(self), self.start_byte, self.end_line, self.end_byte)
+
+    def __repr__(self):
+        return "Position(start_line={}, start_byte={}, end_line={}, end_byte={})".format(
+            int(self), self.start_byte, self.end_line, self.end_byte)
+
+
+# Position of a start line only (lxml), created without calling Python code
+line_position = functools.partial(int.__new__, Position)
+
+
+def start_tags(ancestors) -> str:
+    """
+    Rebuilds the start tags of the ancestors with their original namespace prefixes, so the end
+    tags of the document close them.
+    :param ancestors: list of (tag, attrib, namespace declarations) tuples from the root,
+    the declarations are (prefix, uri) pairs, the prefix of the default namespace is ''
+    """
+    scopes = []
+
+    def qname(name):
+        if name[:1] != "{":
+            return name
+        uri, local = name[1:].split("}", 1)
+        for decls in reversed(scopes):
+            for p, u in reversed(decls):
+                if u == uri:
+                    return p + ":" + local if p else local
+        if uri == "http://www.w3.org/XML/1998/namespace":
+            return "xml:" + local
+        return local
+
+    tags = []
+    for tag, attrib, decls in ancestors:
+        scopes.append(decls)
+        parts = [qname(tag)]
+        for p, u in decls:
+            parts.append(("xmlns:" + p if p else "xmlns") + "=" + quoteattr(u))
+        for k, v in attrib.items():
+            parts.append(qname(k) + "=" + quoteattr(v))
+        tags.append("<" + " ".join(parts) + ">")
+    return "".join(tags)
+
+
+class Checkpoint:
+    """
+    State for resuming a parse: the byte offset of the start tag of the next record (the records
+    before it are completed), its line number and the open ancestors with the XML declaration.
+    """
+
+    def __init__(self, offset: int, line: int, ancestors: list, declaration: str=None):
+        self.offset = offset
+        self.line = line
+        self.ancestors = ancestors      # [(tag, attrib, [(ns prefix, uri), ...]), ...]
+        self.declaration = declaration
+
+    def header(self) -> str:
+        """
+        :return: the text to be parsed before the rest of the document
+        """
+        return (self.declaration or "") + start_tags(self.ancestors)
+
+    def to_json(self) -> str:
+        return json.dumps({"offset": self.offset, "line": self.line,
+                           "ancestors": self.ancestors, "declaration": self.declaration})
+
+    @staticmethod
+    def from_json(s: str):
+        d = json.loads(s)
+        return Checkpoint(d["offset"], d["line"],
+                          [(tag, attrib, [tuple(decl) for decl in decls])
+                           for tag, attrib, decls in d["ancestors"]],
+                          d["declaration"])
+
+    def __repr__(self):
+        return "Checkpoint(offset={}, line={}, ancestors={})".format(
+            self.offset, self.line, [tag for tag, _, _ in self.ancestors])
+
+
+class PositionParser:
+    """
+    Pull parser like XMLPullParser of xml.etree with 'start' and 'end' events, built directly on
+    expat to know the location of the events. While read_events() iterates, the line and byte
+    attributes are the location of the current event's tag.
+    """
+
+    def __init__(self, etree):
+        self._builder = etree.TreeBuilder()
+        self._parse_error = etree.ParseError
+        self._parser = None
+        self._events = []
+        self._prev = b""            # The last two fed chunks to find the end of the end tags
+        self._cur = b""
+        self._prev_offset = 0
+        self._buffer = None
+        self.line = 0
+        self.byte = 0
+        self.decls = ()             # Namespace declarations of the current start tag
+        self.declaration = None     # The XML declaration of the document
+
+    def _create(self, data):
+        # The str chunks are fed as UTF-8 bytes, the bytes are fed as they are.
+        parser = pyexpat.ParserCreate("utf-8" if isinstance(data, str) else None, "}")
+        parser.buffer_text = True
+        builder = self._builder
+        append = self._events.append
+        pending = []
+
+        def fix(name):
+            return "{" + name if "}" in name else name
+
+        def start(tag, attrib):
+            if "}" in tag:
+                tag = "{" + tag
+            for key in attrib:
+                if "}" in key:
+                    attrib = {fix(k): v for k, v in attrib.items()}
+                    break
+            if pending:
+                decls = tuple(pending)
+                pending.clear()
+            else:
+                decls = ()
+            append(('start', builder.start(tag, attrib),
+                    parser.CurrentLineNumber, parser.CurrentByteIndex, decls))
+
+        def end(tag):
+            if "}" in tag:
+                tag = "{" + tag
+            append(('end', builder.end(tag), parser.CurrentLineNumber, parser.CurrentByteIndex, ()))
+
+        def namespace(prefix, uri):
+            pending.append((prefix or "", uri))
+
+        def declaration(version, encoding, standalone):
+            self.declaration = '<?xml version="{}"{}{}?>'.format(
+                version or "1.0", ' encoding="{}"'.format(encoding) if encoding else "",
+                "" if standalone < 0 else ' standalone="{}"'.format("yes" if standalone else "no"))
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = builder.data
+        parser.StartNamespaceDeclHandler = namespace
+        parser.XmlDeclHandler = declaration
+        self._parser = parser
+
+    def feed(self, data):
+        if self._parser is None:
+            self._create(data)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif not isinstance(data, bytes):
+            data = bytes(data)          # The buffer of the chunk can be reused by the reader
+        self._remember(data)
+        try:
+            self._parser.Parse(data, False)
+        except pyexpat.ExpatError as e:
+            err = self._parse_error(str(e))
+            err.code = e.code
+            err.position = e.lineno, e.offset
+            raise err
+
+    def _remember(self, data):
+        self._prev_offset += len(self._prev)
+        self._prev = self._cur
+        self._cur = data
+        self._buffer = None
+
+    def read_events(self):
+        batch = self._events[:]
+        self._events.clear()
+        for action, element, self.line, self.byte, self.decls in batch:
+            yield action, element
+
+    def end_byte(self, start: int, byte: int):
+        """
+        :param start: offset of the start tag given by the start event
+        :param byte: offset given by the end event, it is the offset of the end tag or the
+        offset after an empty element tag
+        :return: offset after the end tag or None if it is not in the last two chunks
+        """
+        if self._buffer is None:
+            self._buffer = self._prev + self._cur
+        buf = self._buffer
+        i = byte - self._prev_offset
+        if i < 0 or i > len(buf):
+            return None
+        s = start - self._prev_offset
+        if s >= 0 and buf.endswith(b"/>", s, i) and buf.find(b"<", s + 1, i) < 0:
+            return byte
+        j = buf.find(b">", i)
+        return None if j < 0 else self._prev_offset + j + 1
@@ -0,0 +1,84 @@
+import collections
+from .aggregate import Extractor, attr, text
+
+__author__ = 'Móréh, Tamás'
+
+# The record types by their field names
+_TYPES = {}
+
+
+def record_type(fields: tuple):
+    """
+    :return: the namedtuple type (without instance dicts) of the records with these fields. The
+    records are pickled by their fields, so they can be passed between processes.
+    """
+    try:
+        return _TYPES[fields]
+    except KeyError:
+        pass
+    try:
+        cls = collections.namedtuple("Record", fields)
+    except ValueError as e:
+        raise Exception("Invalid field name in the projection: {}".format(e))
+    cls.__reduce__ = lambda self: (_record, (fields, tuple(self)))
+    _TYPES[fields] = cls
+    return cls
+
+
+def _record(fields: tuple, values: tuple):
+    return record_type(fields)._make(values)
+
+
+def _coerce(extractor: Extractor, convert) -> Extractor:
+    def coerced(element):
+        value = extractor(element)
+        if value is None:
+            return None
+        try:
+            return convert(value)
+        except (ValueError, TypeError):
+            return None
+    e = Extractor(coerced)
+    e.path = extractor.path
+    return e
+
+
+def field_extractor(spec) -> Extractor:
+    """
+    :param spec: "." (the text of the element), "@name" (an attribute), "a/b" (the text of the
+    first child at the path), "a/b/@name" (its attribute), an Extractor (eg. yax.count("a")) or
+    a tuple of one of them and a type (or any callable) which converts the value
+    """
+    if isinstance(spec, tuple) and len(spec) == 2 and callable(spec[1]):
+        return _coerce(field_extractor(spec[0]), spec[1])
+    if isinstance(spec, Extractor):
+        return spec
+    if isinstance(spec, str):
+        if spec == ".":
+            return text()
+        if "@" not in spec:
+            return text(spec)
+        path, _, name = spec.rpartition("@")
+        if not name or path and not path.endswith("/"):
+            raise Exception("Invalid field in the projection: " + spec)
+        return attr(name, path.rstrip("/") or None)
+    if callable(spec):
+        return Extractor(spec)
+    raise Exception("Invalid field in the projection: {!r}".format(spec))
+
+
+class Projection:
+    """
+    Converter of CallbackRunner.project(): builds a record of the values given by the spec.
+    """
+
+    def __init__(self, spec: dict):
+        if not spec:
+            raise Exception("The projection needs at least one field.")
+        self.type = record_type(tuple(spec))
+        self._extractors = [field_extractor(s) for s in spec.values()]
+        self._make = self.type._make
+        self.paths = [e.path for e in self._extractors if e.path is not None]
+
+    def __call__(self, element):
+        return self._make([e(element) for e in self._extractors])
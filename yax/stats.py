@@ -0,0 +1,165 @@
+import time
+
+__author__ = 'Móréh, Tamás'
+
+
+class ConditionStats:
+    __slots__ = ("checks", "matches", "check_time")
+
+    def __init__(self):
+        self.checks = 0
+        self.matches = 0
+        self.check_time = 0.0
+
+
+class RunnerStats:
+    __slots__ = ("calls", "callback_time", "conversions", "convert_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.callback_time = 0.0
+        self.conversions = 0
+        self.convert_time = 0.0
+
+
+class Stats:
+    """
+    Statistics of the parses of a YAXReader (see YAXReader.collect_stats()). While a parse runs,
+    the check functions of the registered conditions (in the dispatch table) and the callbacks
+    and converters of the CallbackRunners are replaced with timing wrappers, so nothing is
+    measured without it.
+    The fed bytes and the retained elements are counted at each chunk, the retained elements
+    are the elements in the tree right after the chunk is fed (lxml: before the tag filter).
+    The threaded callbacks are counted approximately, the parallel parsing is not measured.
+    """
+
+    def __init__(self, on_report=None, interval: float=10.0):
+        """
+        :param on_report: called with a snapshot() in every interval seconds (checked at the
+        chunks) and at the end of each parse
+        """
+        self._on_report = on_report
+        self._interval = interval
+        self._restore = []
+        self.reset()
+
+    def reset(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.elements = 0
+        self.retained = 0
+        self.retained_max = 0
+        self.elapsed = 0.0
+        self._conditions = {}           # index -> (condition, ConditionStats)
+        self._runners = {}              # index -> RunnerStats
+        self._started = None
+        self._next_report = None
+
+    def snapshot(self) -> dict:
+        """
+        :return: the current values as a dict of plain types (the times are in seconds)
+        """
+        elapsed = self.elapsed
+        if self._started is not None:
+            elapsed += time.perf_counter() - self._started
+        return {"bytes": self.bytes, "chunks": self.chunks, "elements": self.elements,
+                "retained": self.retained, "retained_max": self.retained_max,
+                "elapsed": elapsed,
+                "conditions": [{"index": i, "tag": repr(getattr(cond, "_raw", (None, ))[0]),
+                                "checks": s.checks, "matches": s.matches,
+                                "check_time": s.check_time}
+                               for i, (cond, s) in sorted(self._conditions.items())],
+                "runners": [{"index": i, "calls": s.calls, "callback_time": s.callback_time,
+                             "conversions": s.conversions, "convert_time": s.convert_time}
+                            for i, s in sorted(self._runners.items())]}
+
+    def start(self, table, cnds: list):
+        """
+        Instruments the dispatch table, the conditions and the runners of a parse.
+        """
+        self._started = time.perf_counter()
+        self._next_report = self._started + self._interval
+        handlers = table.handlers
+
+        def counting_handlers(tag):
+            self.elements += 1
+            return handlers(tag)
+
+        table.handlers = counting_handlers
+        for i, (cond, cb_runner) in enumerate(cnds):
+            if i not in self._conditions:
+                self._conditions[i] = (cond, ConditionStats())
+                self._runners[i] = RunnerStats()
+            table.checks[i] = self._timed_check(table.checks[i], self._conditions[i][1])
+            s = self._runners[i]
+            self._wrap(cb_runner, "_callback", self._timed_callback(cb_runner._callback, s))
+            self._wrap(cb_runner, "_convert", self._timed_convert(cb_runner._convert, s))
+
+    def _wrap(self, obj, name, wrapper):
+        self._restore.append((obj, name, obj.__dict__.get(name)))
+        setattr(obj, name, wrapper)
+
+    @staticmethod
+    def _timed_check(check, s):
+        def timed(*args):
+            t = time.perf_counter()
+            result = check(*args)
+            s.check_time += time.perf_counter() - t
+            s.checks += 1
+            if result:
+                s.matches += 1
+            return result
+        return timed
+
+    @staticmethod
+    def _timed_callback(callback, s):
+        def timed(*args):
+            t = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                s.callback_time += time.perf_counter() - t
+                s.calls += 1
+        return timed
+
+    @staticmethod
+    def _timed_convert(convert, s):
+        def timed(element):
+            t = time.perf_counter()
+            try:
+                return convert(element)
+            finally:
+                s.convert_time += time.perf_counter() - t
+                s.conversions += 1
+        return timed
+
+    def fed(self, size: int, root):
+        """
+        Called after each chunk is fed.
+        :param root: the root element of the tree or None if it is unknown yet
+        """
+        self.bytes += size
+        self.chunks += 1
+        if root is not None:
+            self.retained = sum(1 for _ in root.iter())
+            if self.retained > self.retained_max:
+                self.retained_max = self.retained
+        if self._on_report is not None and time.perf_counter() >= self._next_report:
+            self._next_report = time.perf_counter() + self._interval
+            self._on_report(self.snapshot())
+
+    def stop(self):
+        """
+        Restores the instrumented objects at the end of a parse.
+        """
+        for obj, name, value in reversed(self._restore):
+            if value is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+        self._restore = []
+        if self._started is not None:
+            self.elapsed += time.perf_counter() - self._started
+            self._started = None
+        if self._on_report is not None:
+            self._on_report(self.snapshot())
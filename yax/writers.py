@@ -0,0 +1,216 @@
+import io
+import abc
+import itertools
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+__author__ = 'Móréh, Tamás'
+
+# The buffered output is written to the file when it is larger than this.
+FLUSH_SIZE = 1 << 16
+
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+
+def json_pieces(element, attrib_prefix="-", text_prefix="#", ensure_ascii=False) -> list:
+    """
+    Encodes the element as JSON with the mapping of element_to_json_dict, without building the
+    dicts and without recursion (so the depth of the subtree is not limited).
+    The attributes get the attrib_prefix, the child elements are grouped by tag in the order of
+    their first occurrence (a repeated tag gives a list), the stripped not empty text parts come
+    under text_prefix + "text" (a list if there are more of them). An element without attributes
+    and children is only its text. Comments and processing instructions are skipped.
+    :return: list of str pieces of the JSON text
+    """
+    quote = encode_basestring_ascii if ensure_ascii else encode_basestring
+    out = []
+    stack = [element, "{" + quote(element.tag) + ":"]    # str items are written, others expanded
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        texts = [item.text.strip()] if item.text else []
+        groups = {}
+        for child in item:
+            if child.tail:
+                texts.append(child.tail.strip())
+            if isinstance(child.tag, str):
+                groups.setdefault(child.tag, []).append(child)
+        texts = [t for t in texts if t]
+        text = quote(texts[0]) if len(texts) == 1 else "[" + ",".join(map(quote, texts)) + "]"
+        attrib = item.attrib
+        if not attrib and not groups:
+            out.append(text)
+            continue
+        pieces = ["{"]
+        sep = ""
+        for key, value in attrib.items():
+            pieces.append(sep + quote(attrib_prefix + key) + ":" + quote(value))
+            sep = ","
+        for tag, children in groups.items():
+            pieces.append(sep + quote(tag) + ":")
+            sep = ","
+            if len(children) > 1:
+                pieces.append("[")
+                pieces.extend(itertools.chain.from_iterable(zip(children, "," * len(children))))
+                pieces[-1] = "]"
+            else:
+                pieces.append(children[0])
+        if texts:
+            pieces.append(sep + quote(text_prefix + "text") + ":" + text)
+        pieces.append("}")
+        stack.extend(reversed(pieces))
+    out.append("}")
+    return out
+
+
+def _escape_text(s: str) -> str:
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "<" in s:
+        s = s.replace("<", "&lt;")
+    if ">" in s:
+        s = s.replace(">", "&gt;")
+    return s
+
+
+def _escape_attrib(s: str) -> str:
+    s = _escape_text(s)
+    if '"' in s:
+        s = s.replace('"', "&quot;")
+    if "\n" in s:
+        s = s.replace("\n", "&#10;")
+    if "\r" in s:
+        s = s.replace("\r", "&#13;")
+    if "\t" in s:
+        s = s.replace("\t", "&#09;")
+    return s
+
+
+def xml_pieces(element) -> list:
+    """
+    Serializes the element (without its tail) iteratively. The namespaces get the ns0, ns1, ...
+    prefixes (like at xml.etree's tostring) and they are declared in the start tag of the
+    element. Comments and processing instructions are skipped.
+    :return: list of str pieces of the XML fragment
+    """
+    prefixes = {}
+
+    def qname(name):
+        if name[:1] != "{":
+            return name
+        uri, local = name[1:].split("}", 1)
+        if uri == _XML_NAMESPACE:
+            return "xml:" + local
+        prefix = prefixes.get(uri)
+        if prefix is None:
+            prefixes[uri] = prefix = "ns{}".format(len(prefixes))
+        return prefix + ":" + local
+
+    out = []
+    stack = [element]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        if not isinstance(item.tag, str):
+            if item.tail and item is not element:
+                out.append(_escape_text(item.tail))
+            continue
+        tag = qname(item.tag)
+        start = ["<", tag]
+        for key, value in item.attrib.items():
+            start.append(" {}=\"{}\"".format(qname(key), _escape_attrib(value)))
+        out.append("".join(start))
+        if item is element:
+            declarations = len(out) - 1
+        if len(item) or item.text:
+            out.append(">")
+            if item.text:
+                out.append(_escape_text(item.text))
+            end = "</" + tag + ">"
+            stack.append(end + _escape_text(item.tail) if item.tail and item is not element
+                         else end)
+            stack.extend(reversed(item))
+        else:
+            out.append(" />" + (_escape_text(item.tail) if item.tail and item is not element
+                                else ""))
+    if prefixes:
+        out[declarations] += "".join(" xmlns:{}=\"{}\"".format(p, _escape_attrib(uri))
+                                     for uri, p in sorted(prefixes.items(), key=lambda t: t[1]))
+    return out
+
+
+class Sink(abc.ABC):
+    """
+    Callback which writes the encoded matches (one per line) to a file. The output is collected
+    in a buffer and written in batches of flush_size bytes, flush() writes the rest. Binary
+    files get UTF-8 bytes, text files get str. The subclasses implement encode().
+    """
+
+    def __init__(self, fp, flush_size: int=FLUSH_SIZE):
+        self._fp = fp
+        self._text = isinstance(fp, io.TextIOBase)
+        self._flush_size = flush_size
+        self._buffer = [] if self._text else bytearray()
+        self._size = 0
+
+    key = None          # Sinks with the same key encode the same element in the same way
+
+    @abc.abstractmethod
+    def encode(self, element):
+        """
+        :return: the line of the element (str for text files, bytes for binary files)
+        """
+
+    def __call__(self, data, line=0):
+        if self._text:
+            self._buffer.append(data)
+            self._size += len(data)
+        else:
+            self._buffer += data
+            self._size = len(self._buffer)
+        if self._size >= self._flush_size:
+            self.flush()
+
+    def flush(self):
+        if self._size:
+            self._fp.write("".join(self._buffer) if self._text else self._buffer)
+            self._buffer = [] if self._text else bytearray()
+            self._size = 0
+
+
+class JsonlSink(Sink):
+    """
+    Writes the matches as JSON Lines with the mapping of the JSON_DICT converter.
+    """
+
+    def __init__(self, fp, attrib_prefix="-", text_prefix="#", ensure_ascii=False,
+                 flush_size: int=FLUSH_SIZE):
+        super().__init__(fp, flush_size)
+        self._options = (attrib_prefix, text_prefix, ensure_ascii)
+        self.key = ("jsonl", self._text) + self._options
+
+    def encode(self, element):
+        s = "".join(json_pieces(element, *self._options)) + "\n"
+        return s if self._text else s.encode("utf-8")
+
+
+class XmlSink(Sink):
+    """
+    Writes the matches as XML fragments, one per line (the new lines inside the elements are
+    kept).
+    """
+
+    def __init__(self, fp, flush_size: int=FLUSH_SIZE):
+        super().__init__(fp, flush_size)
+        self.key = ("xml", self._text)
+
+    def encode(self, element):
+        if hasattr(element, "getparent"):      # lxml serializes it in C without the recursion
+            from lxml import etree
+            s = etree.tostring(element, encoding="unicode", with_tail=False) + "\n"
+        else:
+            s = "".join(xml_pieces(element)) + "\n"
+        return s if self._text else s.encode("utf-8")